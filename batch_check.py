@@ -0,0 +1,222 @@
+import argparse
+import asyncio
+import csv
+import json
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+import tracing
+import circuit_breaker
+import webmail_sessions
+import preflight
+from get_remaining_meals import get_remaining_meals
+
+ACCOUNT_FIELDS = ("bilkent_id", "stars_password", "email", "email_password")
+
+
+def _jsonl_rows(stream):
+    """(line number, row or None, problem or None) for each non-blank JSONL line."""
+    for line_no, line in enumerate(stream, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except json.JSONDecodeError as e:
+            # The message names the position only, never the line's content
+            yield line_no, None, f"invalid JSON: {e.msg}"
+            continue
+        if not isinstance(row, dict):
+            yield line_no, None, "not a JSON object"
+            continue
+        yield line_no, row, None
+
+
+def _csv_rows(stream):
+    reader = csv.DictReader(stream)
+    for row in reader:
+        yield reader.line_num, row, None
+
+
+def iter_accounts(stream, fmt):
+    """
+    Lazily yield account dicts from a JSONL or CSV stream.
+
+    Args:
+        stream: Open text stream to read from
+        fmt (str): "jsonl" or "csv" (CSV must have a header row)
+
+    Yields:
+        dict: Account with the four credential fields and an optional "label",
+        or a label and an "invalid" reason for lines that cannot be used
+    """
+    rows = _csv_rows(stream) if fmt == "csv" else _jsonl_rows(stream)
+
+    for line_no, row, problem in rows:
+        if problem is None:
+            missing = [field for field in ACCOUNT_FIELDS if not row.get(field)]
+            if missing:
+                problem = "missing fields: " + ", ".join(missing)
+        if problem:
+            yield {"label": (row or {}).get("label") or f"line {line_no}", "invalid": problem}
+            continue
+        account = {field: str(row[field]).strip() for field in ACCOUNT_FIELDS}
+        account["label"] = row.get("label") or account["bilkent_id"]
+        yield account
+
+
+def check_account(account):
+    """
+    Run the meal pipeline for one account on the calling thread.
+
+    get_remaining_meals drives Selenium synchronously, so every account gets
+    its own thread and event loop to actually run in parallel.
+
+    Returns:
+        dict: JSON-serialisable result including latency and error class
+    """
+    result = {"account": account["label"], "ok": False, "remaining_meals": None, "error": None}
+    if "invalid" in account:
+        result["error"] = "InvalidAccount"
+        result["detail"] = account["invalid"]
+        result["latency_s"] = 0.0
+        return result
+
+    try:
+        preflight.validate_credentials(*(account[field] for field in ACCOUNT_FIELDS))
+    except preflight.CredentialsRejected as e:
+        result["error"] = "InvalidAccount"
+        result["detail"] = e.reason
+        result["latency_s"] = 0.0
+        return result
+
+    secrets = (account["stars_password"], account["email"], account["email_password"])
+    started = time.perf_counter()
+    try:
+        with tracing.trace_request(secrets=secrets) as request_id:
+            result["correlation_id"] = request_id
+            remaining_meals = asyncio.run(
+                get_remaining_meals(
+                    bilkent_id=account["bilkent_id"],
+                    stars_password=account["stars_password"],
+                    email=account["email"],
+                    email_password=account["email_password"],
+                )
+            )
+        if remaining_meals is None:
+            result["error"] = "NoResult"
+        else:
+            result["ok"] = True
+            result["remaining_meals"] = remaining_meals
+    except Exception as e:
+        result["error"] = type(e).__name__
+    result["latency_s"] = round(time.perf_counter() - started, 3)
+    return result
+
+
+async def run_batch(accounts, concurrency, out=sys.stdout):
+    """
+    Check accounts with at most `concurrency` pipelines in flight.
+
+    Accounts are pulled from the iterator on demand and each result is written
+    as one JSON line as soon as it finishes, so neither side is buffered.
+
+    Returns:
+        dict: Summary with counts, elapsed time and throughput
+    """
+    queue = asyncio.Queue(maxsize=concurrency)
+    counts = {"accounts": 0, "ok": 0, "failed": 0}
+    loop = asyncio.get_running_loop()
+    # The loop's default executor has min(32, cpu_count + 4) threads and would
+    # silently cap higher levels, so each run gets exactly `concurrency` threads
+    executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="batch")
+
+    async def worker():
+        while True:
+            account = await queue.get()
+            if account is None:
+                return
+            result = await loop.run_in_executor(executor, check_account, account)
+            result["concurrency"] = concurrency
+            counts["accounts"] += 1
+            counts["ok" if result["ok"] else "failed"] += 1
+            out.write(json.dumps(result) + "\n")
+            out.flush()
+
+    started = time.perf_counter()
+    try:
+        workers = [asyncio.create_task(worker()) for _ in range(concurrency)]
+        for account in accounts:
+            await queue.put(account)
+        for _ in workers:
+            await queue.put(None)
+        await asyncio.gather(*workers)
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+    elapsed = time.perf_counter() - started
+
+    return {
+        "summary": True,
+        "concurrency": concurrency,
+        **counts,
+        "elapsed_s": round(elapsed, 3),
+        "accounts_per_min": round(counts["accounts"] * 60 / elapsed, 2) if elapsed else 0.0,
+        "breakers": circuit_breaker.snapshot(),
+        "webmail_sessions": webmail_sessions.cache.stats(),
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Check remaining meals for many accounts, one JSON line per account."
+    )
+    parser.add_argument(
+        "input",
+        help="JSONL or CSV file with bilkent_id, stars_password, email, email_password "
+        "(and optional label) per account, or '-' for stdin",
+    )
+    parser.add_argument(
+        "--format",
+        choices=("jsonl", "csv"),
+        help="Input format (default: guessed from the file extension, jsonl for stdin)",
+    )
+    parser.add_argument(
+        "--concurrency",
+        default="2",
+        help="Pipelines in flight; a comma-separated list (e.g. 1,2,4) re-runs the "
+        "whole file at each level and reports throughput for each",
+    )
+    args = parser.parse_args(argv)
+
+    try:
+        args.concurrency = [int(level) for level in args.concurrency.split(",")]
+    except ValueError:
+        parser.error("--concurrency must be an integer or a comma-separated list of integers")
+    if any(level < 1 for level in args.concurrency):
+        parser.error("--concurrency levels must be at least 1")
+    if args.input == "-" and len(args.concurrency) > 1:
+        parser.error("several concurrency levels need a file input, stdin can only be read once")
+    if not args.format:
+        args.format = "csv" if args.input.lower().endswith(".csv") else "jsonl"
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    # Logs go to stderr so stdout carries only results
+    tracing.setup_logging()
+    summaries = []
+
+    for concurrency in args.concurrency:
+        if args.input == "-":
+            summary = asyncio.run(run_batch(iter_accounts(sys.stdin, args.format), concurrency))
+        else:
+            with open(args.input, newline="") as f:
+                summary = asyncio.run(run_batch(iter_accounts(f, args.format), concurrency))
+        summaries.append(summary)
+        print(json.dumps(summary), file=sys.stderr, flush=True)
+
+    return 0 if all(summary["failed"] == 0 for summary in summaries) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
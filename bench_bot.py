@@ -0,0 +1,310 @@
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import resource
+import statistics
+from collections import Counter, deque
+from types import SimpleNamespace
+from telegram import Update
+from telegram.constants import ParseMode
+from telegram.ext import Application, Defaults, SimpleUpdateProcessor
+from telegram.request import BaseRequest
+from update_processing import PerUserUpdateProcessor, UPDATE_CONCURRENCY
+
+CREDENTIALS = "12345678\nSRSPass123\nname.surname@ug.bilkent.edu.tr\nemailPass456"
+
+
+def _percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+async def run_burst(processor, users, per_user, rtt, api_calls):
+    """
+    Push a burst of updates through an update processor the way Application does.
+
+    Each update stands in for handle_credentials: `api_calls` sequential
+    Telegram round trips (delete, reply) of `rtt` seconds each.
+
+    Returns:
+        dict: Throughput, latency percentiles and whether per-user order held
+    """
+    handled = {}  # user_id -> sequence numbers in the order they were handled
+    latencies = []
+
+    async def handler(user_id, seq, queued_at):
+        for _ in range(api_calls):
+            await asyncio.sleep(rtt)
+        handled.setdefault(user_id, []).append(seq)
+        latencies.append(time.perf_counter() - queued_at)
+
+    # Users interleave randomly; each user's updates are numbered in arrival order
+    senders = [user_id for user_id in range(users) for _ in range(per_user)]
+    random.shuffle(senders)
+    next_seq = dict.fromkeys(range(users), 0)
+    ordered = []
+    for user_id in senders:
+        ordered.append((user_id, next_seq[user_id]))
+        next_seq[user_id] += 1
+
+    await processor.initialize()
+    started = time.perf_counter()
+    tasks = []
+    for user_id, seq in ordered:
+        update = SimpleNamespace(effective_user=SimpleNamespace(id=user_id))
+        coroutine = handler(user_id, seq, time.perf_counter())
+        # Application creates one task per update when updates are concurrent
+        tasks.append(asyncio.create_task(processor.process_update(update, coroutine)))
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started
+    await processor.shutdown()
+
+    return {
+        "processor": type(processor).__name__,
+        "max_concurrent": processor.max_concurrent_updates,
+        "updates": len(ordered),
+        "elapsed_s": round(elapsed, 3),
+        "updates_per_s": round(len(ordered) / elapsed, 1),
+        "p50_ms": round(statistics.median(latencies) * 1000, 1),
+        "p99_ms": round(_percentile(latencies, 0.99) * 1000, 1),
+        "per_user_order_kept": all(seqs == sorted(seqs) for seqs in handled.values()),
+    }
+
+
+class FakeTelegramRequest(BaseRequest):
+    """
+    Telegram transport that answers every Bot API call locally.
+
+    Requests are still serialised by the real Bot, so the measured cost
+    includes everything up to the network, plus an optional fixed round trip.
+    """
+
+    def __init__(self, rtt: float = 0.0):
+        self.rtt = rtt
+        self.calls = Counter()
+        self._message_ids = iter(range(1, sys.maxsize))
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    async def do_request(self, url, method, request_data=None, **timeouts):
+        api_method = url.rsplit("/", 1)[-1]
+        self.calls[api_method] += 1
+        if self.rtt:
+            await asyncio.sleep(self.rtt)
+
+        params = request_data.parameters if request_data else {}
+        if api_method == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+        elif api_method in ("sendMessage", "editMessageText", "sendDocument"):
+            result = {
+                "message_id": params.get("message_id") or next(self._message_ids),
+                "date": int(time.time()),
+                "chat": {"id": params.get("chat_id", 0), "type": "private"},
+                "text": params.get("text", ""),
+            }
+        else:
+            result = True
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+
+def _deep_size(obj, seen=None) -> int:
+    """Approximate bytes held by a container and everything inside it."""
+    seen = seen if seen is not None else set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(_deep_size(k, seen) + _deep_size(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset, deque)):
+        size += sum(_deep_size(item, seen) for item in obj)
+    return size
+
+
+def _update_dicts(user_id: int, messages: int):
+    """Raw updates for one simulated user: /start, the example button, then credentials."""
+    user = {"id": user_id, "is_bot": False, "first_name": f"User{user_id}"}
+    chat = {"id": user_id, "type": "private"}
+
+    def message(text, **extra):
+        return {"message_id": 1, "date": int(time.time()), "chat": chat, "from": user, "text": text, **extra}
+
+    if messages == 0:
+        yield {"message": message("/start", entities=[{"type": "bot_command", "offset": 0, "length": 6}])}
+        yield {
+            "callback_query": {
+                "id": str(user_id),
+                "from": user,
+                "chat_instance": str(user_id),
+                "data": "copy_example",
+                "message": message("Bilkent Meals Bot"),
+            }
+        }
+    yield {"message": message(CREDENTIALS)}
+
+
+async def run_load(users, engine_latency, api_rtt, concurrency, in_flight, spam_fraction):
+    """
+    Drive bot.py's handlers with simulated users and a stub meal engine.
+
+    Every user sends /start, presses the example button and sends credentials.
+    A fraction of users ("spammers") then keep resending credentials, one round
+    at a time, until check_spam bans them.
+
+    Returns:
+        dict: Throughput, update latency percentiles, Telegram calls and the
+        size of the bot's per-user state at its peak and after the run
+    """
+    import bot
+    import state_backend
+
+    # Fresh in-memory state per run so sizes can be read directly
+    bot.state = state_backend.InMemoryBackend()
+    bot.active_user_tasks.clear()
+
+    async def stub_engine(bilkent_id, stars_password, email, email_password, status_callback=None):
+        if status_callback:
+            await status_callback("🔐 Logging in to SRS...")
+        await asyncio.sleep(random.uniform(0.5, 1.5) * engine_latency)
+        return random.randint(0, 60)
+
+    bot.get_remaining_meals = stub_engine
+    # Offline: no reachability probes against the real upstreams
+    bot.preflight.PREFLIGHT_PROBE = False
+
+    transport = FakeTelegramRequest(api_rtt)
+    application = (
+        Application.builder()
+        .token("123456:bench")
+        .defaults(Defaults(parse_mode=ParseMode.HTML))
+        .request(transport)
+        .get_updates_request(FakeTelegramRequest())
+        .concurrent_updates(PerUserUpdateProcessor(concurrency))
+        .build()
+    )
+    bot.add_handlers(application)
+
+    structures = {
+        "user_message_times": lambda: bot.state.user_message_times,
+        "banned_users": lambda: bot.state.banned_users,
+        "active_jobs": lambda: bot.state.active_jobs,
+        "active_user_tasks": lambda: bot.active_user_tasks,
+    }
+    peak = dict.fromkeys(structures, 0)
+    latencies = []
+    window = asyncio.Semaphore(in_flight)
+    update_id = iter(range(1, sys.maxsize))
+
+    async def handle(update, received_at):
+        try:
+            await application.process_update(update)
+            latencies.append(time.perf_counter() - received_at)
+        finally:
+            window.release()
+
+    async def feed(user_ids, messages):
+        tasks = set()
+        for user_id in user_ids:
+            for data in _update_dicts(user_id, messages):
+                await window.acquire()
+                update = Update.de_json({"update_id": next(update_id), **data}, application.bot)
+                coroutine = handle(update, time.perf_counter())
+                # Same path as Application's polling loop
+                task = asyncio.create_task(application.update_processor.process_update(update, coroutine))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        await asyncio.gather(*tasks)
+        # Wait out the background meal requests the credentials spawned
+        while bot.active_user_tasks:
+            await asyncio.gather(*list(bot.active_user_tasks.values()))
+
+    async def sample():
+        while True:
+            for name, get in structures.items():
+                peak[name] = max(peak[name], len(get()))
+            await asyncio.sleep(0.05)
+
+    rss_before_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    async with application:
+        sampler = asyncio.create_task(sample())
+        started = time.perf_counter()
+        await feed(range(users), 0)
+        spammers = range(int(users * spam_fraction))
+        for messages in range(1, bot.SPAM_THRESHOLD + 1):
+            await feed(spammers, messages)
+        elapsed = time.perf_counter() - started
+        sampler.cancel()
+    final = {name: len(get()) for name, get in structures.items()}
+
+    return {
+        "users": users,
+        "updates": len(latencies),
+        "elapsed_s": round(elapsed, 2),
+        "updates_per_s": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(statistics.median(latencies) * 1000, 2),
+        "p95_ms": round(_percentile(latencies, 0.95) * 1000, 2),
+        "p99_ms": round(_percentile(latencies, 0.99) * 1000, 2),
+        "telegram_calls": dict(transport.calls),
+        "peak_entries": {name: max(peak[name], final[name]) for name in structures},
+        "final_entries": final,
+        "final_kb": {name: round(_deep_size(get()) / 1024, 1) for name, get in structures.items()},
+        "max_rss_growth_mb": round(
+            (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before_kb) / 1024, 1
+        ),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark update processing under a synthetic burst, sequential vs per-user concurrent."
+    )
+    parser.add_argument("--users", type=int, default=200, help="Distinct users in the burst")
+    parser.add_argument("--per-user", type=int, default=3, help="Updates sent by each user")
+    parser.add_argument("--rtt", type=float, default=0.05, help="Simulated Telegram API round trip (s), both modes")
+    parser.add_argument("--api-calls", type=int, default=2, help="API round trips per update")
+    parser.add_argument("--concurrency", default="8,32,128", help="Comma-separated concurrency limits")
+    parser.add_argument(
+        "--load",
+        metavar="USERS",
+        help=(
+            "Instead of the burst, drive bot.py's handlers with each comma-separated number "
+            "of simulated users (concurrency from UPDATE_CONCURRENCY)"
+        ),
+    )
+    parser.add_argument("--engine-latency", type=float, default=0.05, help="Stub meal engine latency (s), load mode")
+    parser.add_argument("--in-flight", type=int, default=1000, help="Updates in flight at once, load mode")
+    parser.add_argument("--spam-fraction", type=float, default=0.01, help="Users who spam until banned, load mode")
+    args = parser.parse_args(argv)
+
+    if args.load:
+        # Keep per-request INFO logs out of the measurement
+        os.environ.setdefault("LOG_LEVEL", "WARNING")
+        for users in (int(n) for n in args.load.split(",")):
+            result = asyncio.run(
+                run_load(users, args.engine_latency, args.rtt, UPDATE_CONCURRENCY, args.in_flight, args.spam_fraction)
+            )
+            print(json.dumps(result), flush=True)
+        return 0
+
+    burst = (args.users, args.per_user, args.rtt, args.api_calls)
+    # Sequential baseline: PTB's default of one update at a time
+    print(json.dumps(asyncio.run(run_burst(SimpleUpdateProcessor(1), *burst))), flush=True)
+    for limit in (int(n) for n in args.concurrency.split(",")):
+        print(json.dumps(asyncio.run(run_burst(PerUserUpdateProcessor(limit), *burst))), flush=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,175 @@
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+from selenium.common.exceptions import WebDriverException
+from concurrent.futures import ThreadPoolExecutor
+import browser
+
+# Small offline page roughly the size of the STARS login form
+DEFAULT_URL = (
+    "data:text/html,<html><body><form><input id='LoginForm_username'>"
+    "<input id='LoginForm_password' type='password'><button type='submit'>Login</button>"
+    "</form></body></html>"
+)
+
+
+def _children(pid):
+    """Direct child PIDs of pid, read from /proc."""
+    children = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # Field 4 is the parent PID; the command name may contain spaces
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        if ppid == pid:
+            children.append(int(entry))
+    return children
+
+
+def _process_tree(pid):
+    tree, pending = [], [pid]
+    while pending:
+        current = pending.pop()
+        tree.append(current)
+        pending.extend(_children(current))
+    return tree
+
+
+def _pss_kb(pid):
+    """Proportional set size, so pages shared between Chrome processes count once."""
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                if line.startswith("Pss:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+def session_memory_mb(driver):
+    """Memory of chromedriver plus every Chrome process it spawned."""
+    pids = _process_tree(driver.service.process.pid)
+    return sum(_pss_kb(pid) for pid in pids) / 1024, len(pids)
+
+
+def measure(profile, sessions, url, settle):
+    """
+    Open `sessions` concurrent Chrome sessions with one profile and measure them.
+
+    Returns:
+        dict: Total and per-session memory, process count and sessions per GB
+    """
+
+    def open_session(_):
+        driver = browser.new_driver(profile=profile, stealth=True)
+        driver.get(url)
+        return driver
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=sessions) as pool:
+        drivers = list(pool.map(open_session, range(sessions)))
+    launch_s = time.perf_counter() - started
+
+    try:
+        time.sleep(settle)
+        total_mb, processes = 0.0, 0
+        for driver in drivers:
+            memory_mb, process_count = session_memory_mb(driver)
+            total_mb += memory_mb
+            processes += process_count
+    finally:
+        with ThreadPoolExecutor(max_workers=sessions) as pool:
+            list(pool.map(browser.quit_driver, drivers))
+
+    per_session_mb = total_mb / sessions
+    return {
+        "profile": profile,
+        "sessions": sessions,
+        "launch_s": round(launch_s, 2),
+        "total_mb": round(total_mb, 1),
+        "per_session_mb": round(per_session_mb, 1),
+        "processes_per_session": round(processes / sessions, 1),
+        "sessions_per_gb": round(1024 / per_session_mb, 1) if per_session_mb else None,
+    }
+
+
+def measure_cold_launch(profile, runs, template):
+    """
+    Time sequential launch -> first page -> quit cycles, with or without the profile template.
+
+    Returns:
+        dict: Median, mean and worst launch time (launch until the first page is loaded)
+    """
+    if template and not browser.build_profile_template(profile):
+        return {"profile": profile, "template": True, "error": "template build failed"}
+
+    try:
+        launch_times = []
+        for _ in range(runs):
+            started = time.perf_counter()
+            driver = browser.new_driver(profile=profile, stealth=True)
+            try:
+                driver.get("about:blank")
+                launch_times.append(time.perf_counter() - started)
+            finally:
+                browser.quit_driver(driver)
+    finally:
+        browser.discard_profile_template()
+
+    return {
+        "profile": profile,
+        "template": template,
+        "runs": runs,
+        "median_s": round(statistics.median(launch_times), 3),
+        "mean_s": round(statistics.mean(launch_times), 3),
+        "max_s": round(max(launch_times), 3),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Measure Chrome memory per concurrent session, or cold launch time, for each browser profile."
+    )
+    parser.add_argument("--profiles", default="default,lowmem", help="Comma-separated profiles")
+    parser.add_argument("--sessions", default="1,4", help="Comma-separated concurrent session counts")
+    parser.add_argument("--url", default=DEFAULT_URL, help="Page each session loads (default: offline form)")
+    parser.add_argument("--settle", type=float, default=2.0, help="Seconds to wait before measuring")
+    parser.add_argument(
+        "--cold-launch",
+        type=int,
+        metavar="RUNS",
+        help="Instead of memory, time RUNS cold launches per profile with and without the profile template",
+    )
+    args = parser.parse_args(argv)
+
+    try:
+        return _run(args)
+    except WebDriverException as e:
+        # No numbers are better than a traceback that looks like a result
+        print(f"Could not launch Chrome, nothing was measured: {e.msg}", file=sys.stderr)
+        return 2
+
+
+def _run(args):
+    if args.cold_launch:
+        for profile in args.profiles.split(","):
+            for template in (False, True):
+                print(json.dumps(measure_cold_launch(profile, args.cold_launch, template)), flush=True)
+        return 0
+
+    for profile in args.profiles.split(","):
+        for sessions in (int(n) for n in args.sessions.split(",")):
+            print(json.dumps(measure(profile, sessions, args.url, args.settle)), flush=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
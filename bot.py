@@ -1,8 +1,7 @@
 import os
+import io
 import logging
 import asyncio
-from datetime import datetime, timedelta
-from collections import defaultdict, deque
 from dotenv import load_dotenv
 from telegram import Update
 from telegram.constants import ParseMode
@@ -16,83 +15,107 @@ from telegram.ext import (
     filters,
 )
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
-from get_remaining_meals import get_remaining_meals, OTPRetrievalError, LoginCredentialsError
+from get_remaining_meals import (
+    get_remaining_meals,
+    get_meal_details,
+    OTPRetrievalError,
+    LoginCredentialsError,
+)
+import meal_pages
+import preflight
+import subscriptions
+import circuit_breaker
+from circuit_breaker import UpstreamUnavailableError
+import webmail_sessions
+import tracing
+import state_backend
+import diagnostics
+import browser
+from update_processing import PerUserUpdateProcessor, UPDATE_CONCURRENCY
 
 # Load environment variables from .env file
 load_dotenv()
 
-# Enable logging
-logging.basicConfig(
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
-)
+# Enable logging (JSON lines via a background queue, level from LOG_LEVEL)
+tracing.setup_logging()
 logger = logging.getLogger(__name__)
 
 # Suppress httpx INFO logs (only show warnings and errors)
 logging.getLogger("httpx").setLevel(logging.WARNING)
 
-# In-memory spam detection and ban storage
-# Configuration
+# Spam detection and ban configuration
 SPAM_THRESHOLD = 4  # Number of messages allowed
 SPAM_TIME_WINDOW = 300  # Time window in seconds
 BAN_DURATION = 1800  # Ban duration in seconds (30 minutes)
+JOB_TTL = 600  # Seconds after which an unfinished job no longer blocks its user
+
+# Telegram user IDs allowed to use admin commands (comma-separated)
+ADMIN_USER_IDS = {
+    int(user_id) for user_id in os.getenv("ADMIN_USER_IDS", "").split(",") if user_id.strip()
+}
+
+RETRIEVAL_FAILED_TEXT = (
+    "❌ Couldn't retrieve meals this time.\n\n"
+    "🔎 Possible reasons:\n"
+    "• ❗ Incorrect credentials\n"
+    "• 🌐 Network hiccups\n"
+    "• 🛠️ SRS service might be down\n\n"
+    "🛡️ Your message was deleted for privacy—feel free to try again."
+)
 
-# Storage
-user_message_times = defaultdict(deque)  # user_id -> deque of timestamps
-banned_users = {}  # user_id -> ban_expiry_time
-
-# Track active tasks per user (to prevent duplicate requests from same user)
+# Replies for credentials rejected by preflight checks, before any browser work
+PREFLIGHT_MESSAGES = {
+    preflight.INVALID_BILKENT_ID: "❌ <b>Invalid SRS ID</b>\n\nThe first line must be your 8-digit Bilkent ID.",
+    preflight.INVALID_EMAIL_DOMAIN: (
+        "❌ <b>Invalid Email</b>\n\n"
+        "The third line must be your Bilkent email, e.g. name.surname@ug.bilkent.edu.tr."
+    ),
+    preflight.SHORT_STARS_PASSWORD: (
+        "❌ <b>Invalid SRS Password</b>\n\nSRS passwords are at least 6 characters long."
+    ),
+}
+
+# Active jobs, rate-limit windows and bans. In memory by default; a shared
+# backend (sqlite:///path or redis://...) lets several workers run side by side.
+state = state_backend.from_url(os.getenv("STATE_BACKEND", "memory"))
+
+# Task handles for jobs running in this process (keeps them referenced)
 active_user_tasks = {}  # user_id -> task
 
 
-def is_user_banned(user_id: int) -> tuple[bool, int]:
+async def is_user_banned(user_id: int) -> tuple[bool, int]:
     """Check if a user is banned and return ban status with remaining time."""
-    if user_id in banned_users:
-        ban_expiry = banned_users[user_id]
-        if datetime.now() < ban_expiry:
-            remaining_seconds = int((ban_expiry - datetime.now()).total_seconds())
-            return True, remaining_seconds
-        else:
-            # Ban expired, remove from banned list
-            del banned_users[user_id]
-            # Clean up message history
-            if user_id in user_message_times:
-                user_message_times[user_id].clear()
-    return False, 0
+    remaining_seconds = await state.call("ban_remaining", user_id)
+    return remaining_seconds > 0, remaining_seconds
 
 
-def check_spam(user_id: int) -> bool:
+async def check_spam(user_id: int) -> bool:
     """Check if user is spamming and ban if threshold exceeded."""
-    now = datetime.now()
-
-    # Get user's message timestamps
-    message_times = user_message_times[user_id]
-
-    # Remove old timestamps outside the time window
-    cutoff_time = now - timedelta(seconds=SPAM_TIME_WINDOW)
-    while message_times and message_times[0] < cutoff_time:
-        message_times.popleft()
-
-    # Add current message timestamp
-    message_times.append(now)
+    message_count = await state.call("record_message", user_id, SPAM_TIME_WINDOW)
 
     # Check if spam threshold exceeded
-    if len(message_times) > SPAM_THRESHOLD:
-        # Ban the user
-        banned_users[user_id] = now + timedelta(seconds=BAN_DURATION)
+    if message_count > SPAM_THRESHOLD:
+        await state.call("ban", user_id, BAN_DURATION)
         logger.warning(
-            f"User {user_id} banned for spamming. Messages: {len(message_times)} in {SPAM_TIME_WINDOW}s"
+            f"User {user_id} banned for spamming. Messages: {message_count} in {SPAM_TIME_WINDOW}s"
         )
         return True
 
     return False
 
 
+async def release_job(user_id: int) -> bool:
+    """Mark the user's job finished, locally and in the shared state."""
+    active_user_tasks.pop(user_id, None)
+    return await state.call("finish_job", user_id)
+
+
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Send instructions when the user starts the bot."""
     user_id = update.effective_user.id
 
     # Check if user is banned
-    is_banned, remaining_time = is_user_banned(user_id)
+    is_banned, remaining_time = await is_user_banned(user_id)
     if is_banned:
         minutes = remaining_time // 60
         seconds = remaining_time % 60
@@ -150,11 +173,19 @@ async def process_user_request(
     username: str = None,
     first_name: str = None,
     last_name: str = None,
+    subscribe_threshold: int = None,
+    chat_id: int = None,
+    job_queue=None,
+    profile: bool = False,
+    details: bool = False,
 ) -> None:
     """Process a single user's meal request in the background."""
-    
+    # Everything logged by this task (scraper modules included) carries its ID
+    request_id = tracing.bind_request(secrets=(stars_password, email, email_password))
+    logger.info(f"Processing request {request_id} for user {user_id}")
+
     # Check if user is banned
-    is_banned, remaining_time = is_user_banned(user_id)
+    is_banned, remaining_time = await is_user_banned(user_id)
     if is_banned:
         minutes = remaining_time // 60
         seconds = remaining_time % 60
@@ -165,22 +196,7 @@ async def process_user_request(
             f"Please wait before using the bot again."
         )
         # Remove task from active tasks when banned
-        if user_id in active_user_tasks:
-            del active_user_tasks[user_id]
-        return
-
-    # Check for spam
-    if check_spam(user_id):
-        minutes = BAN_DURATION // 60
-        await status_message.edit_text(
-            f"🚫 <b>Spam Detected!</b>\n\n"
-            f"You've sent too many messages too quickly.\n"
-            f"⏱️ Banned for: {minutes} minutes\n\n"
-            f"Please wait before using the bot again."
-        )
-        # Remove task from active tasks when banned for spam
-        if user_id in active_user_tasks:
-            del active_user_tasks[user_id]
+        await release_job(user_id)
         return
 
     # Create callback function for status updates
@@ -190,26 +206,67 @@ async def process_user_request(
         except Exception as e:
             logger.warning(f"Could not update status message: {e}")
 
+    # Admin-requested sampling profile of this request (see /profile)
+    profiler = diagnostics.SamplingProfiler().start() if profile else None
+
     try:
-        # Directly await get_remaining_meals since we're already in async context
-        remaining_meals = await get_remaining_meals(
-            bilkent_id=bilkent_id,
-            stars_password=stars_password,
-            email=email,
-            email_password=email_password,
-            status_callback=update_status,
-        )
+        subscription_note = ""
+        if subscribe_threshold is not None:
+            subscription_note = (
+                f"\n\n🔔 Balance alerts on: you'll be notified when you have "
+                f"fewer than {subscribe_threshold} meals. Send /unsubscribe to stop."
+            )
 
-        if remaining_meals is not None:
-            await status_message.edit_text(
-                f"🍽️ <b>Meals Remaining:</b> {remaining_meals}\n😊 Afiyet olsun!"
+        if details:
+            # /details: balance plus order and transaction tables from one login
+            meal_details = await get_meal_details(
+                bilkent_id=bilkent_id,
+                stars_password=stars_password,
+                email=email,
+                email_password=email_password,
+                status_callback=update_status,
+            )
+            if meal_details is None:
+                await status_message.edit_text(RETRIEVAL_FAILED_TEXT)
+                return
+            reply = meal_pages.format_details(
+                meal_details, max_length=meal_pages.MAX_MESSAGE_LENGTH - len(subscription_note)
+            )
+        else:
+            # Directly await get_remaining_meals since we're already in async context
+            remaining_meals = await get_remaining_meals(
+                bilkent_id=bilkent_id,
+                stars_password=stars_password,
+                email=email,
+                email_password=email_password,
+                status_callback=update_status,
+            )
+            if remaining_meals is None:
+                return
+            reply = f"🍽️ <b>Meals Remaining:</b> {remaining_meals}\n😊 Afiyet olsun!"
+
+        if subscribe_threshold is not None:
+            subscriptions.subscribe(
+                job_queue,
+                user_id=user_id,
+                chat_id=chat_id,
+                threshold=subscribe_threshold,
+                bilkent_id=bilkent_id,
+                stars_password=stars_password,
+                email=email,
+                email_password=email_password,
             )
+            reply += subscription_note
+        await status_message.edit_text(reply)
     except LoginCredentialsError:
         # Show specific message for incorrect credentials
         await status_message.edit_text(
             "❌ Login failed: Incorrect Bilkent ID or password.\n\n"
             "🛡️ Your message was deleted for privacy—feel free to try again."
         )
+    except UpstreamUnavailableError as e:
+        # Circuit open: answer immediately instead of waiting out timeouts
+        await status_message.edit_text(upstream_down_text(e.upstream))
     except OTPRetrievalError:
         # Show specific message for OTP/email issues
         await status_message.edit_text(
@@ -218,32 +275,54 @@ async def process_user_request(
     except Exception as e:
         # Catch-all for unexpected errors
         logger.error(f"Error fetching meals for user {user_id}: {e}")
-        await status_message.edit_text(
-            "❌ Couldn't retrieve meals this time.\n\n"
-            "🔎 Possible reasons:\n"
-            "• ❗ Incorrect credentials\n"
-            "• 🌐 Network hiccups\n"
-            "• 🛠️ SRS service might be down\n\n"
-            "🛡️ Your message was deleted for privacy—feel free to try again."
-        )
+        await status_message.edit_text(RETRIEVAL_FAILED_TEXT)
     finally:
+        if profiler:
+            await send_profile(status_message, profiler, request_id)
+
         # Remove task from active tasks when done
-        if user_id in active_user_tasks:
-            del active_user_tasks[user_id]
+        if await release_job(user_id):
             logger.info(
                 f"Completed request for user {user_id} "
                 f"(username: @{username}, name: {first_name} {last_name})"
             )
 
 
+def upstream_down_text(upstream: str) -> str:
+    service = "SRS" if upstream == "stars" else "Bilkent Webmail"
+    return (
+        f"🛠️ <b>{service} is down</b>\n\n"
+        "It's not responding right now, so your request wasn't attempted.\n"
+        "Please try again in a few minutes.\n\n"
+        "🛡️ Your message was deleted for privacy."
+    )
+
+
+async def send_profile(status_message, profiler, request_id: str) -> None:
+    """Stop a request's profiler and send the collapsed stacks as a file."""
+    collapsed = profiler.stop()
+    try:
+        await status_message.reply_document(
+            document=io.BytesIO(collapsed.encode()),
+            filename=f"profile-{request_id}.folded",
+            caption=(
+                f"🔬 Profile of request <code>{request_id}</code>: "
+                f"{profiler.samples} samples over {profiler.duration:.1f}s\n"
+                "Open with speedscope.app or flamegraph.pl."
+            ),
+        )
+    except Exception as e:
+        logger.warning(f"Could not send profile: {e}")
+
+
 async def handle_credentials(
     update: Update, context: ContextTypes.DEFAULT_TYPE
 ) -> None:
     """Parse credentials and fetch remaining meals concurrently."""
     user_id = update.effective_user.id
 
-    # Check if user already has an active request
-    if user_id in active_user_tasks:
+    # Claim the user's job slot (atomic across workers sharing the state backend)
+    if not await state.call("try_start_job", user_id, JOB_TTL):
         try:
             await update.message.delete()
         except Exception as e:
@@ -256,74 +335,238 @@ async def handle_credentials(
         )
         return
 
-    # Check if user is banned
-    is_banned, remaining_time = is_user_banned(user_id)
-    if is_banned:
-        minutes = remaining_time // 60
-        seconds = remaining_time % 60
+    # Until the task below owns the slot, any failure must give it back
+    try:
+        # Check if user is banned
+        is_banned, remaining_time = await is_user_banned(user_id)
+        if is_banned:
+            await release_job(user_id)
+            minutes = remaining_time // 60
+            seconds = remaining_time % 60
+            # Delete the message containing credentials for security
+            try:
+                await update.message.delete()
+            except Exception as e:
+                logger.warning(f"Could not delete credentials message: {e}")
+
+            await update.message.reply_text(
+                f"🚫 <b>Temporarily Banned</b>\n\n"
+                f"You've been temporarily banned for spamming.\n"
+                f"⏱️ Time remaining: {minutes}m {seconds}s\n\n"
+                f"Please wait before using the bot again."
+            )
+            return
+
+        message_text = update.message.text.strip()
+
         # Delete the message containing credentials for security
         try:
             await update.message.delete()
         except Exception as e:
             logger.warning(f"Could not delete credentials message: {e}")
 
-        await update.message.reply_text(
-            f"🚫 <b>Temporarily Banned</b>\n\n"
-            f"You've been temporarily banned for spamming.\n"
-            f"⏱️ Time remaining: {minutes}m {seconds}s\n\n"
-            f"Please wait before using the bot again."
+        # Count every credentials message, so malformed or rejected ones are rate-limited too
+        if await check_spam(user_id):
+            await release_job(user_id)
+            minutes = BAN_DURATION // 60
+            await update.message.reply_text(
+                f"🚫 <b>Spam Detected!</b>\n\n"
+                f"You've sent too many messages too quickly.\n"
+                f"⏱️ Banned for: {minutes} minutes\n\n"
+                f"Please wait before using the bot again."
+            )
+            return
+
+        # Parse the message (expecting 4 lines)
+        lines = [line.strip() for line in message_text.split("\n") if line.strip()]
+
+        if len(lines) != 4:
+            await release_job(user_id)
+            await update.message.reply_text(
+                "❌ <b>Invalid Format</b>\n\n"
+                "Please send <b>4 lines</b> in <b>one</b> message:\n"
+                "• SRS ID\n"
+                "• SRS Password\n"
+                "• Email (for OTP/2FA)\n"
+                "• Email Password\n\n"
+                "Send /start to see the example."
+            )
+            return
+
+        bilkent_id, stars_password, email, email_password = lines
+
+        # Reject in milliseconds what STARS or webmail would refuse after a browser launch
+        try:
+            preflight.validate_credentials(bilkent_id, stars_password, email, email_password)
+            await preflight.check_upstreams()
+        except preflight.CredentialsRejected as e:
+            await release_job(user_id)
+            await update.message.reply_text(
+                PREFLIGHT_MESSAGES[e.reason]
+                + "\n\n🛡️ Your message was deleted for privacy—feel free to try again."
+            )
+            return
+        except UpstreamUnavailableError as e:
+            await release_job(user_id)
+            await update.message.reply_text(upstream_down_text(e.upstream))
+            return
+
+        # Opt-in from a preceding /subscribe command
+        subscribe_threshold = context.chat_data.pop("pending_subscription", None)
+        # Armed by an admin's /profile command
+        profile = context.chat_data.pop("profile_next", False)
+        # Armed by a preceding /details command
+        details = context.chat_data.pop("pending_details", False)
+
+        # Notify user that process is starting
+        status_message = await update.message.reply_text(
+            "✅ Credentials received...\n"
         )
+
+        # Create and track the background task for this user
+        user = update.effective_user
+        task = asyncio.create_task(
+            process_user_request(
+                user_id=user_id,
+                bilkent_id=bilkent_id,
+                stars_password=stars_password,
+                email=email,
+                email_password=email_password,
+                status_message=status_message,
+                username=user.username,
+                first_name=user.first_name,
+                last_name=user.last_name,
+                subscribe_threshold=subscribe_threshold,
+                chat_id=update.effective_chat.id,
+                job_queue=context.job_queue,
+                profile=profile,
+                details=details,
+            )
+        )
+    except BaseException:
+        await release_job(user_id)
+        raise
+
+    active_user_tasks[user_id] = task
+    logger.info(
+        f"Started concurrent request for user {user_id}. Active tasks: {len(active_user_tasks)}"
+    )
+
+
+async def subscribe_command(
+    update: Update, context: ContextTypes.DEFAULT_TYPE
+) -> None:
+    """Opt in to periodic balance checks; credentials come with the next message."""
+    if not subscriptions.is_enabled():
+        await update.message.reply_text("🔕 Balance alerts are not available on this bot.")
         return
 
-    message_text = update.message.text.strip()
+    threshold = subscriptions.DEFAULT_THRESHOLD
+    if context.args:
+        if not context.args[0].isdigit():
+            await update.message.reply_text(
+                "❌ Usage: <code>/subscribe 10</code> (alert below 10 meals)"
+            )
+            return
+        threshold = int(context.args[0])
 
-    # Delete the message containing credentials for security
-    try:
-        await update.message.delete()
-    except Exception as e:
-        logger.warning(f"Could not delete credentials message: {e}")
+    context.chat_data["pending_subscription"] = threshold
+    await update.message.reply_text(
+        "🔔 <b>Balance Alerts</b>\n\n"
+        f"I'll check your balance periodically and tell you when it drops below {threshold} meals.\n\n"
+        "⚠️ <b>To do this your credentials are stored</b>, encrypted, on the bot's server "
+        "until you send /unsubscribe.\n\n"
+        "📥 Send your 4-line credentials message now to confirm."
+    )
 
-    # Parse the message (expecting 4 lines)
-    lines = [line.strip() for line in message_text.split("\n") if line.strip()]
 
-    if len(lines) != 4:
+async def unsubscribe_command(
+    update: Update, context: ContextTypes.DEFAULT_TYPE
+) -> None:
+    """Stop balance alerts and delete stored credentials."""
+    context.chat_data.pop("pending_subscription", None)
+    if subscriptions.is_enabled() and subscriptions.unsubscribe(
+        context.job_queue, update.effective_user.id
+    ):
         await update.message.reply_text(
-            "❌ <b>Invalid Format</b>\n\n"
-            "Please send <b>4 lines</b> in <b>one</b> message:\n"
-            "• SRS ID\n"
-            "• SRS Password\n"
-            "• Email (for OTP/2FA)\n"
-            "• Email Password\n\n"
-            "Send /start to see the example."
+            "🔕 Balance alerts stopped. Your stored credentials were deleted."
         )
-        return
+    else:
+        await update.message.reply_text("🔕 You have no active balance alerts.")
 
-    bilkent_id, stars_password, email, email_password = lines
 
-    # Notify user that process is starting
-    status_message = await update.message.reply_text(
-        "✅ Credentials received...\n"
+async def details_command(
+    update: Update, context: ContextTypes.DEFAULT_TYPE
+) -> None:
+    """Show meal orders and transactions too; credentials come with the next message."""
+    context.chat_data["pending_details"] = True
+    await update.message.reply_text(
+        "📋 <b>Meal Details</b>\n\n"
+        "Besides your balance I'll fetch your recent meal orders and transactions, "
+        "all from a single login.\n\n"
+        "📥 Send your 4-line credentials message now."
     )
 
-    # Create and track the background task for this user
-    user = update.effective_user
-    task = asyncio.create_task(
-        process_user_request(
-            user_id=user_id,
-            bilkent_id=bilkent_id,
-            stars_password=stars_password,
-            email=email,
-            email_password=email_password,
-            status_message=status_message,
-            username=user.username,
-            first_name=user.first_name,
-            last_name=user.last_name,
-        )
+
+async def profile_command(
+    update: Update, context: ContextTypes.DEFAULT_TYPE
+) -> None:
+    """Admin only: profile the next request sent in this chat."""
+    if update.effective_user.id not in ADMIN_USER_IDS:
+        return
+
+    context.chat_data["profile_next"] = True
+    await update.message.reply_text(
+        "🔬 Your next credentials message will be profiled end to end.\n"
+        f"⏱️ Loop lag: {diagnostics.watchdog.stats()}"
     )
 
-    active_user_tasks[user_id] = task
-    logger.info(
-        f"Started concurrent request for user {user_id}. Active tasks: {len(active_user_tasks)}"
+
+async def stats_command(
+    update: Update, context: ContextTypes.DEFAULT_TYPE
+) -> None:
+    """Admin only: read-only view of upstream health and load."""
+    if update.effective_user.id not in ADMIN_USER_IDS:
+        return
+
+    lines = ["📊 <b>Bot Stats</b>", ""]
+    for name, breaker in circuit_breaker.snapshot().items():
+        lines.append(
+            f"🔌 {name}: <b>{breaker['state']}</b> "
+            f"(ok {breaker['successes']}, failed {breaker['failures']}, "
+            f"shed {breaker['rejected']}, opened {breaker['opened']}x)"
+        )
+    lines.append(f"🚧 Preflight rejections: {preflight.stats() or 'none'}")
+    lines.append(f"⚙️ Active requests: {len(active_user_tasks)}")
+    lines.append(f"⏱️ Loop lag: {diagnostics.watchdog.stats()}")
+    if webmail_sessions.enabled():
+        lines.append(f"📬 Webmail sessions: {webmail_sessions.cache.stats()}")
+    await update.message.reply_text("\n".join(lines))
+
+
+async def post_init(application: Application) -> None:
+    """Start background diagnostics and warm up Chrome once the event loop is running."""
+    if diagnostics.LOOP_WATCHDOG:
+        diagnostics.watchdog.start()
+
+    # Sessions launched before the template is ready simply start from scratch
+    if browser.PROFILE_TEMPLATE:
+        application.create_task(asyncio.to_thread(browser.build_profile_template))
+
+
+def add_handlers(application: Application) -> None:
+    """Register the bot's command, callback and message handlers."""
+    application.add_handler(CommandHandler("start", start))
+    application.add_handler(CommandHandler("subscribe", subscribe_command))
+    application.add_handler(CommandHandler("unsubscribe", unsubscribe_command))
+    application.add_handler(CommandHandler("details", details_command))
+    application.add_handler(CommandHandler("profile", profile_command))
+    application.add_handler(CommandHandler("stats", stats_command))
+    application.add_handler(
+        CallbackQueryHandler(copy_example_callback, pattern="^copy_example$")
+    )
+    application.add_handler(
+        MessageHandler(filters.TEXT & ~filters.COMMAND, handle_credentials)
     )
 
 
@@ -344,16 +587,20 @@ def main() -> None:
         Application.builder()
         .token(token)
         .defaults(Defaults(parse_mode=ParseMode.HTML))
+        .post_init(post_init)
+        # Different users' updates run concurrently; one user's stay in order
+        .concurrent_updates(PerUserUpdateProcessor(UPDATE_CONCURRENCY))
         .build()
     )
 
-    # Add handlers
-    application.add_handler(CommandHandler("start", start))
-    application.add_handler(
-        CallbackQueryHandler(copy_example_callback, pattern="^copy_example$")
-    )
-    application.add_handler(
-        MessageHandler(filters.TEXT & ~filters.COMMAND, handle_credentials)
+    add_handlers(application)
+
+    # Background balance checks only run while few foreground requests are active
+    subscriptions.setup(
+        application,
+        is_busy=lambda: len(active_user_tasks) >= subscriptions.BUSY_THRESHOLD,
+        claim_job=lambda user_id: state.call("try_start_job", user_id, JOB_TTL),
+        release_job=release_job,
     )
 
     # Start the bot
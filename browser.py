@@ -0,0 +1,225 @@
+import os
+import atexit
+import shutil
+import logging
+import tempfile
+import threading
+from selenium import webdriver
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+CHROME_PROFILE = os.getenv("CHROME_PROFILE", "default")  # "default" or "lowmem"
+RENDERER_PROCESS_LIMIT = int(os.getenv("CHROME_RENDERER_LIMIT", 2))  # lowmem only
+PROFILE_TEMPLATE = os.getenv("CHROME_PROFILE_TEMPLATE", "0") == "1"  # Opt-in: prebuild a profile at startup
+
+PROFILES = ("default", "lowmem")
+
+USER_AGENT = (
+    "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 "
+    "(KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
+)
+
+# tmpfs keeps per-session profile writes out of the dyno's disk
+TMPFS_DIR = "/dev/shm"
+TMPFS_DISK_CACHE_BYTES = 1024 * 1024  # Cache cap for profiles on tmpfs, which is small in containers
+
+# Files tying a profile to the Chrome instance that created it
+_PROFILE_LOCK_FILES = ("SingletonLock", "SingletonCookie", "SingletonSocket")
+
+_template_dir = None
+_live_dirs = set()  # user-data directories of sessions not yet cleaned up
+_live_dirs_lock = threading.Lock()
+
+
+def _profile_parent_dir():
+    if os.path.isdir(TMPFS_DIR) and os.access(TMPFS_DIR, os.W_OK):
+        return TMPFS_DIR
+    return None
+
+
+def build_options(profile: str = None, stealth: bool = False):
+    """
+    Chrome options for one headless session.
+
+    Args:
+        profile (str): "default" (the original full browser) or "lowmem"
+            (small viewport, capped renderers, no background work, minimal
+            cache, no images); defaults to CHROME_PROFILE
+        stealth (bool): Add the anti-automation-detection settings used for STARS
+
+    Returns:
+        ChromeOptions: Options, not yet bound to a user-data directory
+    """
+    profile = profile or CHROME_PROFILE
+    if profile not in PROFILES:
+        raise ValueError(f"Unknown Chrome profile: {profile}")
+
+    options = webdriver.ChromeOptions()
+    options.add_argument("--headless=new")
+    options.add_argument("--no-sandbox")
+    options.add_argument("--disable-dev-shm-usage")
+    options.add_argument("--disable-gpu")
+
+    # Anti-detection settings
+    options.add_argument("--disable-blink-features=AutomationControlled")
+    options.add_experimental_option("excludeSwitches", ["enable-automation"])
+    options.add_experimental_option("useAutomationExtension", False)
+
+    # Chrome only honours the last --disable-features, so collect them
+    disabled_features = []
+
+    if stealth:
+        options.add_argument("--disable-extensions")
+        options.add_argument("--disable-plugins-discovery")
+        options.add_argument("--disable-web-security")
+        options.add_argument("--allow-running-insecure-content")
+        options.add_argument(f"--user-agent={USER_AGENT}")
+        options.add_argument("--disable-ipc-flooding-protection")
+        disabled_features.append("VizDisplayCompositor")
+
+    if profile == "lowmem":
+        options.add_argument("--window-size=800,600")
+        options.add_argument(f"--renderer-process-limit={RENDERER_PROCESS_LIMIT}")
+        options.add_argument("--disable-background-networking")
+        options.add_argument("--disable-component-update")
+        options.add_argument("--disable-default-apps")
+        options.add_argument("--disable-sync")
+        options.add_argument("--no-first-run")
+        options.add_argument("--metrics-recording-only")
+        options.add_argument("--disk-cache-size=1")
+        options.add_argument("--media-cache-size=1")
+        options.add_argument("--aggressive-cache-discard")
+        disabled_features += ["Translate", "MediaRouter", "OptimizationHints", "BackForwardCache"]
+        # The flows only read text and forms
+        options.add_experimental_option(
+            "prefs", {"profile.managed_default_content_settings.images": 2}
+        )
+    else:
+        options.add_argument("--window-size=1920,1080")
+
+    if disabled_features:
+        options.add_argument("--disable-features=" + ",".join(disabled_features))
+
+    return options
+
+
+def build_profile_template(profile: str = None):
+    """
+    Launch Chrome once so it initialises a profile, and keep that directory.
+
+    Sessions then start from a copy of it instead of an empty directory,
+    skipping profile database creation and first-run work on every launch.
+    The template lives on tmpfs when available, which makes the copy cheap.
+
+    Returns:
+        str or None: Template directory, None if it could not be built
+    """
+    global _template_dir
+
+    template_dir = tempfile.mkdtemp(prefix="srs-chrome-template-", dir=_profile_parent_dir())
+    options = build_options(profile)
+    options.add_argument("--no-first-run")
+    options.add_argument(f"--user-data-dir={template_dir}")
+    try:
+        driver = webdriver.Chrome(options=options)
+        try:
+            driver.get("about:blank")
+        finally:
+            driver.quit()
+    except Exception as e:
+        logger.warning(f"Could not build Chrome profile template: {e}")
+        shutil.rmtree(template_dir, ignore_errors=True)
+        return None
+
+    for name in _PROFILE_LOCK_FILES:
+        path = os.path.join(template_dir, name)
+        if os.path.lexists(path):
+            os.remove(path)
+
+    if _template_dir:
+        shutil.rmtree(_template_dir, ignore_errors=True)
+    _template_dir = template_dir
+    logger.info(f"Chrome profile template ready at {template_dir}")
+    return template_dir
+
+
+def discard_profile_template() -> None:
+    global _template_dir
+    if _template_dir:
+        shutil.rmtree(_template_dir, ignore_errors=True)
+        _template_dir = None
+
+
+def _new_user_data_dir(profile):
+    """Per-session user-data directory: a copy of the template, a fresh tmpfs dir, or None."""
+    if _template_dir is None and profile != "lowmem":
+        # Let chromedriver create and remove its own temporary profile
+        return None
+
+    user_data_dir = tempfile.mkdtemp(prefix="srs-chrome-", dir=_profile_parent_dir())
+    with _live_dirs_lock:
+        _live_dirs.add(user_data_dir)
+    if _template_dir:
+        try:
+            shutil.copytree(_template_dir, user_data_dir, symlinks=True, dirs_exist_ok=True)
+        except Exception:
+            _remove_user_data_dir(user_data_dir)
+            raise
+    return user_data_dir
+
+
+def _remove_user_data_dir(user_data_dir):
+    shutil.rmtree(user_data_dir, ignore_errors=True)
+    with _live_dirs_lock:
+        _live_dirs.discard(user_data_dir)
+
+
+@atexit.register
+def _cleanup():
+    with _live_dirs_lock:
+        leftovers = list(_live_dirs)
+    for user_data_dir in leftovers:
+        _remove_user_data_dir(user_data_dir)
+    discard_profile_template()
+
+
+def new_driver(profile: str = None, stealth: bool = False):
+    """
+    Launch a Chrome session with its own throwaway user-data directory.
+
+    Sessions start from the prebuilt profile template when there is one, and
+    the lowmem profile keeps its directory on tmpfs. Always release the
+    session with quit_driver() so the directory is removed.
+    """
+    profile = profile or CHROME_PROFILE
+    options = build_options(profile, stealth=stealth)
+
+    user_data_dir = _new_user_data_dir(profile)
+    if user_data_dir:
+        options.add_argument(f"--user-data-dir={user_data_dir}")
+        if profile != "lowmem" and user_data_dir.startswith(TMPFS_DIR + os.sep):
+            # lowmem already caps its cache; the default profile's would fill /dev/shm
+            options.add_argument(f"--disk-cache-size={TMPFS_DISK_CACHE_BYTES}")
+
+    try:
+        driver = webdriver.Chrome(options=options)
+    except Exception:
+        if user_data_dir:
+            _remove_user_data_dir(user_data_dir)
+        raise
+
+    driver.user_data_dir = user_data_dir
+    return driver
+
+
+def quit_driver(driver) -> None:
+    """Quit the session and remove its user-data directory."""
+    try:
+        driver.quit()
+    except Exception as e:
+        logger.warning(f"Could not quit Chrome cleanly: {e}")
+    finally:
+        user_data_dir = getattr(driver, "user_data_dir", None)
+        if user_data_dir:
+            _remove_user_data_dir(user_data_dir)
@@ -0,0 +1,208 @@
+import os
+import time
+import asyncio
+import logging
+import threading
+import urllib.request
+import urllib.error
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", 3))  # Consecutive failures to open
+RESET_TIMEOUT = int(os.getenv("BREAKER_RESET_TIMEOUT", 60))  # Seconds open before probing again
+PROBE_TIMEOUT = 5  # Seconds for the health probe request
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+
+class UpstreamUnavailableError(Exception):
+    """Raised when an upstream's circuit is open and the request is shed."""
+
+    def __init__(self, upstream: str):
+        super().__init__(f"{upstream} is unavailable")
+        self.upstream = upstream
+
+
+def probe(url: str, timeout: float = PROBE_TIMEOUT) -> bool:
+    """Cheap reachability check: any non-5xx HTTP answer counts as up."""
+    request = urllib.request.Request(url, method="HEAD")
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return response.status < 500
+    except urllib.error.HTTPError as e:
+        return e.code < 500
+    except Exception:
+        return False
+
+
+class CircuitBreaker:
+    """
+    Per-upstream breaker with closed / open / half-open states.
+
+    Closed: requests pass, consecutive failures are counted.
+    Open: requests are rejected immediately for RESET_TIMEOUT seconds.
+    Half-open: a health probe runs; if it passes, one trial request is let
+    through and its outcome closes or re-opens the circuit.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        probe_url: str,
+        failure_threshold: int = FAILURE_THRESHOLD,
+        reset_timeout: float = RESET_TIMEOUT,
+    ):
+        self.name = name
+        self.probe_url = probe_url
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_started_at = None
+        self._stats = {"successes": 0, "failures": 0, "rejected": 0, "opened": 0}
+
+    @property
+    def state(self) -> str:
+        return self._state
+
+    def _transition(self, state: str) -> None:
+        if state == self._state:
+            return
+        previous, self._state = self._state, state
+        if state == OPEN:
+            self._opened_at = time.monotonic()
+            self._stats["opened"] += 1
+            logger.warning(
+                f"Circuit {self.name}: {previous} -> open after {self._failures} failure(s)"
+            )
+        else:
+            logger.info(f"Circuit {self.name}: {previous} -> {state}")
+
+    def before_request(self) -> bool:
+        """
+        Admit a request or shed it. May run a blocking health probe; from the
+        event loop use admit() instead.
+
+        Returns:
+            float: Token of the half-open trial this request was granted and must
+            report back on (or hand back with cancel_trial), None otherwise
+
+        Raises:
+            UpstreamUnavailableError: If the circuit is open
+        """
+        with self._lock:
+            now = time.monotonic()
+            if self._state == CLOSED:
+                return None
+            if self._state == HALF_OPEN:
+                # Only one trial at a time; a trial that never reported back expires
+                if self._trial_started_at is not None and now - self._trial_started_at < self.reset_timeout:
+                    self._stats["rejected"] += 1
+                    raise UpstreamUnavailableError(self.name)
+                self._trial_started_at = now
+                return now
+            if now - self._opened_at < self.reset_timeout:
+                self._stats["rejected"] += 1
+                raise UpstreamUnavailableError(self.name)
+            self._transition(HALF_OPEN)
+            # This caller owns the trial; it probes first
+            self._trial_started_at = now
+
+        # Probe outside the lock so other callers are rejected quickly meanwhile
+        if not probe(self.probe_url):
+            with self._lock:
+                logger.warning(f"Circuit {self.name}: health probe failed")
+                self._trial_started_at = None
+                self._transition(OPEN)
+                self._stats["rejected"] += 1
+            raise UpstreamUnavailableError(self.name)
+        return now
+
+    def cancel_trial(self, token: float = None) -> None:
+        """
+        Hand back a granted trial that was never attempted, so another request can take it.
+
+        Args:
+            token (float): Value before_request() returned; if given, only that
+                trial is handed back, and only while it has not reported back
+        """
+        with self._lock:
+            if self._state != HALF_OPEN:
+                return
+            if token is None or self._trial_started_at == token:
+                self._trial_started_at = None
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._stats["successes"] += 1
+            self._failures = 0
+            self._trial_started_at = None
+            self._transition(CLOSED)
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._stats["failures"] += 1
+            self._failures += 1
+            self._trial_started_at = None
+            if self._state == HALF_OPEN or self._failures >= self.failure_threshold:
+                self._transition(OPEN)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {"state": self._state, "consecutive_failures": self._failures, **self._stats}
+
+
+stars = CircuitBreaker("stars", "https://stars.bilkent.edu.tr/srs/")
+webmail = CircuitBreaker("webmail", "https://webmail.bilkent.edu.tr/")
+
+
+async def admit(*breakers) -> list:
+    """
+    Run before_request() for each breaker without blocking the event loop.
+
+    A closed breaker is checked inline; otherwise the check (and its probe)
+    runs on a worker thread. If a later breaker sheds the request, trials
+    granted by earlier ones are handed back instead of blocking their
+    upstream until the trial times out.
+
+    Returns:
+        list: (breaker, token) for each half-open trial granted; pass it to
+        release() once the request ends
+
+    Raises:
+        UpstreamUnavailableError: For the first breaker that sheds the request
+    """
+    trials = []
+    try:
+        for breaker in breakers:
+            if breaker.state == CLOSED:
+                token = breaker.before_request()
+            else:
+                token = await asyncio.to_thread(breaker.before_request)
+            if token is not None:
+                trials.append((breaker, token))
+    except UpstreamUnavailableError:
+        release(trials)
+        raise
+    return trials
+
+
+def release(trials) -> None:
+    """
+    Hand back the trials from admit() whose upstream was never reached.
+
+    A request can end (bad password, timeout) before it talks to every
+    upstream; a trial that reported back is left alone.
+    """
+    for breaker, token in trials:
+        breaker.cancel_trial(token)
+
+
+def snapshot() -> dict:
+    """State and counters of every breaker, for logs and reports."""
+    return {breaker.name: breaker.snapshot() for breaker in (stars, webmail)}
@@ -0,0 +1,197 @@
+import os
+import sys
+import time
+import asyncio
+import logging
+import threading
+import traceback
+import contextvars
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+LOOP_WATCHDOG = os.getenv("LOOP_WATCHDOG", "1") == "1"
+LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", 0.5))  # Seconds between heartbeats
+LOOP_LAG_THRESHOLD = float(os.getenv("LOOP_LAG_THRESHOLD", 1.0))  # Lag (s) that counts as a stall
+PROFILE_SAMPLE_INTERVAL = 0.005  # Seconds between profiler samples (200 Hz)
+
+# Profiler of the request running in the current context, if any
+_active_profiler = contextvars.ContextVar("active_profiler", default=None)
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+
+class LoopLagWatchdog:
+    """
+    Measures asyncio event-loop lag and reports what is blocking the loop.
+
+    A heartbeat task sleeps for `interval` and records how late it wakes up.
+    A monitor thread watches the heartbeat; when it has been silent for longer
+    than `threshold`, the loop thread is stuck in synchronous code (Selenium,
+    usually) and its current stack is logged once per stall.
+    """
+
+    def __init__(self, interval: float = LOOP_LAG_INTERVAL, threshold: float = LOOP_LAG_THRESHOLD):
+        self.interval = interval
+        self.threshold = threshold
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self.stalls = 0
+        self._last_tick = time.monotonic()
+        self._loop_thread_id = None
+        self._task = None
+        self._stop = threading.Event()
+
+    def start(self) -> None:
+        """Start watching the running event loop. Call from inside the loop."""
+        self._loop_thread_id = threading.get_ident()
+        self._last_tick = time.monotonic()
+        self._task = asyncio.get_running_loop().create_task(self._heartbeat())
+        threading.Thread(target=self._monitor, name="loop-watchdog", daemon=True).start()
+        logger.info(
+            f"Loop watchdog started (interval {self.interval}s, threshold {self.threshold}s)"
+        )
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._task:
+            self._task.cancel()
+
+    async def _heartbeat(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self.last_lag = max(now - expected, 0.0)
+            self.max_lag = max(self.max_lag, self.last_lag)
+            self._last_tick = now
+            if self.last_lag > self.threshold:
+                logger.warning(f"Event loop lagged {self.last_lag:.2f}s")
+
+    def _monitor(self):
+        reported_tick = None
+        while not self._stop.wait(self.interval):
+            last_tick = self._last_tick
+            stalled_for = time.monotonic() - last_tick - self.interval
+            if stalled_for <= self.threshold or reported_tick == last_tick:
+                continue
+            reported_tick = last_tick
+            self.stalls += 1
+            frame = sys._current_frames().get(self._loop_thread_id)
+            stack = "".join(traceback.format_stack(frame)) if frame else "<unavailable>"
+            logger.warning(f"Event loop blocked for {stalled_for:.2f}s, loop thread stack:\n{stack}")
+
+    def stats(self) -> dict:
+        return {
+            "last_lag_s": round(self.last_lag, 3),
+            "max_lag_s": round(self.max_lag, 3),
+            "stalls": self.stalls,
+        }
+
+
+class SamplingProfiler:
+    """
+    Samples the stacks of one request from a background thread.
+
+    Started inside a request's task, it samples the event-loop thread only
+    while that task is the one running, plus any worker threads the request
+    starts through diagnostics.to_thread(), so other users' concurrent work
+    is left out. Output is in collapsed-stack format ("outer;inner count" per
+    line), which flamegraph.pl, speedscope and most flamegraph viewers read
+    directly. Each sample briefly holds the GIL, so at 200 Hz the profiled
+    process runs slightly slower while a profile is taken.
+    """
+
+    def __init__(self, interval: float = PROFILE_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.samples = 0
+        self._stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+        self._started = None
+        self._loop = None
+        self._task = None
+        self._loop_thread_id = None
+        self._worker_ids = set()
+        self._token = None
+        self.duration = 0.0
+
+    def start(self) -> "SamplingProfiler":
+        """Start profiling the calling task. Call from inside the request's task."""
+        self._loop = asyncio.get_running_loop()
+        self._task = asyncio.current_task()
+        self._loop_thread_id = threading.get_ident()
+        self._token = _active_profiler.set(self)
+        self._started = time.monotonic()
+        self._thread = threading.Thread(target=self._sample, name="sampling-profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def track_thread(self, thread_id: int) -> None:
+        self._worker_ids.add(thread_id)
+
+    def untrack_thread(self, thread_id: int) -> None:
+        self._worker_ids.discard(thread_id)
+
+    def _record(self, frame):
+        labels = []
+        while frame is not None:
+            labels.append(_frame_label(frame))
+            frame = frame.f_back
+        self._stacks[";".join(reversed(labels))] += 1
+        self.samples += 1
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            # The loop thread counts only while this request's task is on it
+            if asyncio.current_task(self._loop) is self._task:
+                frame = frames.get(self._loop_thread_id)
+                if frame is not None:
+                    self._record(frame)
+            for thread_id in list(self._worker_ids):
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    self._record(frame)
+
+    def stop(self) -> str:
+        """Stop sampling and return the collapsed stacks."""
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        if self._token is not None:
+            try:
+                _active_profiler.reset(self._token)
+            except ValueError:
+                # Stopped from a different context than it was started in
+                pass
+        self.duration = time.monotonic() - self._started
+        return "".join(f"{stack} {count}\n" for stack, count in self._stacks.most_common())
+
+
+async def to_thread(func, *args):
+    """
+    asyncio.to_thread() that keeps the worker thread in the current request's profile.
+
+    Without an active profiler it is plain asyncio.to_thread().
+    """
+    profiler = _active_profiler.get()
+    if profiler is None:
+        return await asyncio.to_thread(func, *args)
+
+    def run():
+        thread_id = threading.get_ident()
+        profiler.track_thread(thread_id)
+        try:
+            return func(*args)
+        finally:
+            profiler.untrack_thread(thread_id)
+
+    return await asyncio.to_thread(run)
+
+
+watchdog = LoopLagWatchdog()
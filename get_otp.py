@@ -1,10 +1,15 @@
 import time
 import re
-from selenium import webdriver
+import logging
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
-from selenium.common.exceptions import TimeoutException, NoSuchElementException
+from selenium.common.exceptions import TimeoutException, NoSuchElementException, WebDriverException
+import circuit_breaker
+import browser
+import webmail_sessions
+
+logger = logging.getLogger(__name__)
 
 
 def get_otp_from_webmail(email, email_password, wait_time=60):
@@ -20,62 +25,65 @@ def get_otp_from_webmail(email, email_password, wait_time=60):
         str: OTP code if found, None if failed
     """
     driver = None
+    webmail_reached = False
+    keep_session = False
     try:
-        # Initialize Chrome driver
-        options = webdriver.ChromeOptions()
-        options.add_argument("--headless=new")
-        options.add_argument("--no-sandbox")
-        options.add_argument("--disable-dev-shm-usage")
-        options.add_argument("--disable-gpu")
-        options.add_argument("--window-size=1920,1080")
-
-        # Additional options for better stability
-        options.add_argument("--disable-blink-features=AutomationControlled")
-        options.add_experimental_option("excludeSwitches", ["enable-automation"])
-        options.add_experimental_option("useAutomationExtension", False)
-
-        driver = webdriver.Chrome(options=options)
-
-        # Remove webdriver property
-        driver.execute_script(
-            "Object.defineProperty(navigator, 'webdriver', {get: () => undefined})"
-        )
-
-        wait = WebDriverWait(driver, 30)  # Increased timeout
-
-        print("Navigating to Bilkent webmail...")
-        driver.get("https://webmail.bilkent.edu.tr/")
-
-        # Wait for login form to load
-        print("Waiting for login form...")
-        # time.sleep(0.5)  # Give page time to fully load
-
-        email_field = wait.until(EC.element_to_be_clickable((By.ID, "rcmloginuser")))
-        password_field = wait.until(EC.element_to_be_clickable((By.ID, "rcmloginpwd")))
-
-        # Fill in credentials with delays
-        print("Logging in with email")
-        email_field.clear()
-        # time.sleep(0.5)
-        email_field.send_keys(email)
-        # time.sleep(0.5)
-        password_field.clear()
-        # time.sleep(0.5)
-        password_field.send_keys(email_password)
-        # time.sleep(0.5)
-
-        # Submit login form
-        login_button = wait.until(EC.element_to_be_clickable((By.ID, "rcmloginsubmit")))
-        login_button.click()
-
-        # Wait for successful login - look for inbox with longer timeout
-        print("Waiting for successful login...")
-        WebDriverWait(driver, 5).until(
-            EC.presence_of_element_located((By.ID, "mailboxlist"))
-        )
+        # Returning users can skip the Roundcube login (opt-in, memory only)
+        if webmail_sessions.enabled():
+            driver = webmail_sessions.cache.checkout(email, email_password)
+
+            logger.debug(f"Webmail session cache: {webmail_sessions.cache.stats()}")
+
+        if driver:
+            logger.info("Reusing cached webmail session")
+            webmail_reached = True
+            wait = WebDriverWait(driver, 30)
+        else:
+            # Initialize Chrome driver
+            driver = browser.new_driver()
+
+            # Remove webdriver property
+            driver.execute_script(
+                "Object.defineProperty(navigator, 'webdriver', {get: () => undefined})"
+            )
+
+            wait = WebDriverWait(driver, 30)  # Increased timeout
+
+            logger.info("Navigating to Bilkent webmail...")
+            driver.get("https://webmail.bilkent.edu.tr/")
+
+            # Wait for login form to load
+            logger.info("Waiting for login form...")
+            # time.sleep(0.5)  # Give page time to fully load
+
+            email_field = wait.until(EC.element_to_be_clickable((By.ID, "rcmloginuser")))
+            password_field = wait.until(EC.element_to_be_clickable((By.ID, "rcmloginpwd")))
+            webmail_reached = True
+            circuit_breaker.webmail.record_success()
+
+            # Fill in credentials with delays
+            logger.info("Logging in with email")
+            email_field.clear()
+            # time.sleep(0.5)
+            email_field.send_keys(email)
+            # time.sleep(0.5)
+            password_field.clear()
+            # time.sleep(0.5)
+            password_field.send_keys(email_password)
+            # time.sleep(0.5)
+
+            # Submit login form
+            login_button = wait.until(EC.element_to_be_clickable((By.ID, "rcmloginsubmit")))
+            login_button.click()
+
+            # Wait for successful login - look for inbox with longer timeout
+            logger.info("Waiting for successful login...")
+            WebDriverWait(driver, 5).until(
+                EC.presence_of_element_located((By.ID, "mailboxlist"))
+            )
 
         # Wait for new email to arrive with retry mechanism
-        print(f"Waiting up to {wait_time} seconds for OTP email...")
+        logger.info(f"Waiting up to {wait_time} seconds for OTP email...")
         end_time = time.time() + wait_time
         otp = None
 
@@ -109,7 +117,7 @@ def get_otp_from_webmail(email, email_password, wait_time=60):
                     )
 
                     if email_rows:
-                        print(
+                        logger.debug(
                             f"Found {len(email_rows)} email(s), checking the first one..."
                         )
 
@@ -134,19 +142,19 @@ def get_otp_from_webmail(email, email_password, wait_time=60):
                                     "secure login",
                                 ]
                             ):
-                                print(
-                                    f"Found STARS email, clicking: {email_row.text[:100]}..."
+                                logger.debug(
+                                    f"Found STARS email, clicking: {row_text[:100]}..."
                                 )
                                 email_row.click()
                                 break
                             else:
-                                print(
-                                    f"Skipping non-STARS email: {email_row.text[:50]}..."
+                                logger.debug(
+                                    f"Skipping non-STARS email: {row_text[:50]}..."
                                 )
                         else:
                             # If no STARS email found, click the first email as fallback
                             if email_rows:
-                                print(
+                                logger.debug(
                                     "No STARS email found, clicking first email as fallback..."
                                 )
                                 email_rows[0].click()
@@ -165,14 +173,14 @@ def get_otp_from_webmail(email, email_password, wait_time=60):
                             )
                             driver.switch_to.frame(iframe)
                             email_content = driver.page_source
-                            print("Found email content in iframe")
+                            logger.debug("Found email content in iframe")
                         except:
                             # If no iframe, get content from main page
                             driver.switch_to.default_content()
                             email_content = driver.page_source
-                            print("Using main page content")
+                            logger.debug("Using main page content")
 
-                        print("Searching for OTP in email content...")
+                        logger.debug("Searching for OTP in email content...")
 
                         # Extract OTP using multiple patterns
                         otp_patterns = [
@@ -188,7 +196,7 @@ def get_otp_from_webmail(email, email_password, wait_time=60):
                             match = re.search(pattern, email_content, re.IGNORECASE)
                             if match:
                                 otp = match.group(1)
-                                print(f"✓ Found OTP using pattern '{pattern}': {otp}")
+                                logger.info(f"✓ Found OTP using pattern '{pattern}'")
                                 break
 
                         if otp:
@@ -196,7 +204,7 @@ def get_otp_from_webmail(email, email_password, wait_time=60):
                             driver.switch_to.default_content()
 
                             # Delete the email
-                            print("Deleting the email...")
+                            logger.info("Deleting the email...")
                             try:
                                 # Look for delete button with multiple selectors
                                 delete_selectors = [
@@ -220,53 +228,62 @@ def get_otp_from_webmail(email, email_password, wait_time=60):
                                 if delete_button:
                                     delete_button.click()
                                     time.sleep(0.13)
-                                    print("✓ Email deleted successfully")
+                                    logger.info("✓ Email deleted successfully")
                                 else:
-                                    print("Warning: Could not find delete button")
+                                    logger.warning("Could not find delete button")
 
                             except Exception as e:
-                                print(f"Warning: Could not delete email: {e}")
+                                logger.warning(f"Could not delete email: {e}")
 
                             break
                         else:
-                            print(
+                            logger.debug(
                                 "No OTP found in this email, waiting for new email..."
                             )
                             driver.switch_to.default_content()
 
                     else:
-                        print("No emails found yet, waiting...")
+                        logger.debug("No emails found yet, waiting...")
 
                 except Exception as e:
-                    print(f"Error checking emails: {e}")
+                    logger.warning(f"Error checking emails: {e}")
 
                 # Wait before next check if no OTP found yet
                 if not otp:
                     time.sleep(5)
 
             except Exception as e:
-                print(f"Error during email check: {e}")
+                logger.warning(f"Error during email check: {e}")
                 time.sleep(5)
 
         if not otp:
-            print("Timeout waiting for OTP email")
+            logger.warning("Timeout waiting for OTP email")
 
+        # A session that just worked is worth keeping for the user's next check
+        keep_session = otp is not None
         return otp
 
     except Exception as e:
-        print(f"Error in get_otp_from_webmail: {e}")
-        import traceback
-
-        traceback.print_exc()
+        logger.exception(f"Error in get_otp_from_webmail: {e}")
+        # Only count errors from loading webmail itself, not a failed Chrome launch
+        if driver and not webmail_reached and isinstance(e, WebDriverException):
+            circuit_breaker.webmail.record_failure()
         return None
 
     finally:
-        # Close the browser
+        # Close the browser, or park it in the session cache
         if driver:
-            driver.quit()
+            if keep_session and webmail_sessions.enabled():
+                webmail_sessions.cache.checkin(email, email_password, driver)
+            else:
+                browser.quit_driver(driver)
 
 
 if __name__ == "__main__":
+    import tracing
+
+    tracing.setup_logging()
+
     # Test configuration
     EMAIL = "name.surname@ug.bilkent.edu.tr"
     EMAIL_PASSWORD = "emailpass"
@@ -275,7 +292,8 @@ if __name__ == "__main__":
     print("TESTING WEBMAIL OTP RETRIEVAL")
     print("=" * 60)
 
-    otp = get_otp_from_webmail(EMAIL, EMAIL_PASSWORD, wait_time=60)
+    with tracing.trace_request(secrets=(EMAIL_PASSWORD,)):
+        otp = get_otp_from_webmail(EMAIL, EMAIL_PASSWORD, wait_time=60)
 
     print("\n" + "=" * 60)
     if otp:
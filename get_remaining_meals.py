@@ -1,14 +1,34 @@
 import time
-import re
 import json
 import os
-from selenium import webdriver
+import logging
 from selenium.webdriver.common.by import By
 from selenium.webdriver.common.keys import Keys
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
-from selenium.common.exceptions import TimeoutException
+from selenium.common.exceptions import TimeoutException, WebDriverException
 from get_otp import get_otp_from_webmail
+import httpx
+import circuit_breaker
+import browser
+import stars_http
+import meal_pages
+import diagnostics
+
+logger = logging.getLogger(__name__)
+
+STARS_LOGIN_URL = "https://stars.bilkent.edu.tr/srs/"
+MEAL_PAGE_URL = "https://stars.bilkent.edu.tr/srs-v2/meal/order"
+
+# srs-v2 meal pages read by get_meal_details, fetched in parallel in one session
+DETAIL_PAGES = {
+    "order": MEAL_PAGE_URL,
+    "history": "https://stars.bilkent.edu.tr/srs-v2/meal/history",
+}
+
+# "browser" reads the meal page in Chrome; "hybrid" only uses Chrome to log in
+# and fetches the page over pooled HTTP with the session cookies
+MEAL_FETCH_MODE = os.getenv("MEAL_FETCH_MODE", "browser")
 
 
 class OTPRetrievalError(Exception):
@@ -49,6 +69,178 @@ def load_cookies(driver, filepath):
 import asyncio
 
 
+def new_stars_driver():
+    """Launch Chrome with the anti-detection settings STARS needs."""
+    # Initialize Chrome driver with anti-detection settings
+    driver = browser.new_driver(stealth=True)
+
+    try:
+        # Execute script to remove webdriver property
+        driver.execute_script(
+            "Object.defineProperty(navigator, 'webdriver', {get: () => undefined})"
+        )
+
+        # Set additional properties to mimic real browser
+        driver.execute_script(
+            """
+            Object.defineProperty(navigator, 'languages', {
+                get: () => ['en-US', 'en']
+            });
+            Object.defineProperty(navigator, 'plugins', {
+                get: () => [1, 2, 3, 4, 5]
+            });
+        """
+        )
+    except Exception:
+        browser.quit_driver(driver)
+        raise
+
+    return driver
+
+
+async def login_to_stars(
+    driver, bilkent_id, stars_password, email, email_password, update_status
+):
+    """
+    Log in to STARS and complete the email OTP step in an open browser.
+
+    Args:
+        driver: Chrome session from new_stars_driver()
+        bilkent_id (str): Bilkent ID number
+        stars_password (str): STARS password
+        email (str): Bilkent email address for OTP
+        email_password (str): Email password
+        update_status (callable): Async function called with status updates
+
+    Returns:
+        bool: True once the session is authenticated, False if login stalled
+
+    Raises:
+        LoginCredentialsError: If STARS rejects the ID or password
+        OTPRetrievalError: If the OTP could not be read from webmail
+    """
+    wait = WebDriverWait(driver, 15)
+
+    # Navigate to STARS login page
+    logger.info("Navigating to STARS login page...")
+    await update_status("🔐 Logging in to SRS...")
+    try:
+        driver.get(STARS_LOGIN_URL)
+
+        # Add some human-like delay
+        await asyncio.sleep(0.12)  # Fill in Bilkent ID and password
+        logger.info("Entering credentials...")
+        bilkent_id_field = wait.until(
+            EC.presence_of_element_located((By.ID, "LoginForm_username"))
+        )
+        password_field = driver.find_element(By.ID, "LoginForm_password")
+    except WebDriverException:
+        # STARS itself did not serve its login form
+        circuit_breaker.stars.record_failure()
+        raise
+    circuit_breaker.stars.record_success()
+
+    # Human-like typing with delays
+    bilkent_id_field.clear()
+    await asyncio.sleep(0.21)
+    for char in bilkent_id:
+        bilkent_id_field.send_keys(char)
+        # await asyncio.sleep(0.17)
+
+    # await asyncio.sleep(0.31)
+    password_field.clear()
+    for char in stars_password:
+        password_field.send_keys(char)
+        # await asyncio.sleep(0.21)
+
+    # Submit login form
+    login_button = driver.find_element(By.CSS_SELECTOR, "button[type='submit']")
+    login_button.click()
+
+    # Check for login error message
+    try:
+        # Wait briefly to see if error message appears
+        await asyncio.sleep(0.23)
+        page_source = driver.page_source
+        
+        # Check for incorrect credentials message
+        srs_pass_errors = ("Password is too short (minimum is 6 characters)", "The password or Bilkent ID number entered is incorrect",)
+        if any(error in page_source for error in srs_pass_errors):
+            logger.warning("❌ Login failed: Incorrect Bilkent ID or password")
+            await update_status("❌ Login failed: Incorrect Bilkent ID or password")
+            raise LoginCredentialsError("The password or Bilkent ID number entered is incorrect.")
+            
+    except LoginCredentialsError:
+        # Re-raise the login error
+        raise
+    except Exception as e:
+        # Continue if we can't check for error (maybe page is loading)
+        pass
+
+    # Wait for OTP page to load
+    logger.info("Waiting for OTP verification page...")
+
+    # Check if we're on the email verification page
+    try:
+        otp_field = wait.until(
+            EC.presence_of_element_located((By.ID, "EmailVerifyForm_verifyCode"))
+        )
+        logger.info("OTP page loaded successfully")
+    except:
+        logger.warning(
+            "❌ Failed to load OTP page. Make sure to type the passwords correctly."
+        )
+        return False
+
+    # Get OTP from email
+    logger.info("Fetching OTP from email...")
+    await update_status("📧 Getting OTP code...")
+    otp = get_otp_from_webmail(email, email_password, wait_time=60)
+
+    if not otp:
+        logger.warning("Failed to retrieve OTP from email")
+        # Inform user without exposing technical details
+        await update_status("❌ Failed to retrieve OTP from email")
+        # Raise a specific error to let caller decide messaging
+        raise OTPRetrievalError("❌ Failed to retrieve OTP from email")
+
+    logger.info("OTP received")
+    await update_status("🔑 OTP received")
+
+    # Enter OTP in the verification form
+    logger.info("Entering OTP...")
+    otp_field.clear()
+    await asyncio.sleep(0.19)
+
+    # Human-like typing for OTP
+    for char in otp:
+        otp_field.send_keys(char)
+        await asyncio.sleep(0.23)
+
+    await asyncio.sleep(0.12)
+
+    # Submit OTP form
+    verify_button = driver.find_element(By.CSS_SELECTOR, "button[type='submit']")
+    verify_button.click()
+
+    # Wait for successful login with better error handling
+    logger.info("Verifying OTP...")
+    try:
+        # Wait for redirect after successful OTP verification
+        wait.until(
+            lambda driver: "login" not in driver.current_url
+            or "meal" in driver.current_url
+        )
+        logger.info("✓ OTP verification successful")
+        await update_status("✅ SRS login successful\n⏳ Fetching meal data...")
+
+    except TimeoutException:
+        logger.warning("Timeout during OTP verification")
+        return False
+
+    return True
+
+
 async def get_remaining_meals(
     bilkent_id, stars_password, email, email_password, status_callback=None
 ):
@@ -64,6 +256,11 @@ async def get_remaining_meals(
 
     Returns:
         int: Number of remaining meals, None if failed
+
+    Raises:
+        UpstreamUnavailableError: If STARS or webmail is known to be down
+        LoginCredentialsError: If STARS rejects the ID or password
+        OTPRetrievalError: If the OTP could not be read from webmail
     """
 
     async def update_status(message: str):
@@ -71,275 +268,209 @@ async def get_remaining_meals(
         if status_callback:
             await status_callback(message)
 
+    # Shed the request before launching Chrome if an upstream is known to be down
+    trials = await circuit_breaker.admit(circuit_breaker.stars, circuit_breaker.webmail)
+
     driver = None
     try:
-        # Initialize Chrome driver with anti-detection settings
-        options = webdriver.ChromeOptions()
-
-        # Headless mode
-        options.add_argument("--headless=new")
-
-        # Basic stealth settings
-        options.add_argument("--no-sandbox")
-        options.add_argument("--disable-dev-shm-usage")
-        options.add_argument("--disable-gpu")
-        options.add_argument("--window-size=1920,1080")
-
-        # Anti-detection settings
-        options.add_argument("--disable-blink-features=AutomationControlled")
-        options.add_experimental_option("excludeSwitches", ["enable-automation"])
-        options.add_experimental_option("useAutomationExtension", False)
-        options.add_argument("--disable-extensions")
-        options.add_argument("--disable-plugins-discovery")
-        options.add_argument("--disable-web-security")
-        options.add_argument("--allow-running-insecure-content")
-
-        # User agent to appear as regular browser
-        options.add_argument(
-            "--user-agent=Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
-        )
+        driver = new_stars_driver()
 
-        # Additional stealth settings
-        options.add_argument("--disable-features=VizDisplayCompositor")
-        options.add_argument("--disable-ipc-flooding-protection")
+        if not await login_to_stars(
+            driver, bilkent_id, stars_password, email, email_password, update_status
+        ):
+            return None
 
-        driver = webdriver.Chrome(options=options)
+        if MEAL_FETCH_MODE == "hybrid":
+            # Hand the authenticated session to plain HTTP and free the browser now
+            cookies = driver.get_cookies()
+            browser.quit_driver(driver)
+            driver = None
 
-        # Execute script to remove webdriver property
-        driver.execute_script(
-            "Object.defineProperty(navigator, 'webdriver', {get: () => undefined})"
-        )
+            logger.info("Fetching meals page over HTTP...")
+            try:
+                page_source = await diagnostics.to_thread(stars_http.fetch, MEAL_PAGE_URL, cookies)
+            except stars_http.SessionExpiredError:
+                logger.warning("Authentication failed - redirected back to login")
+                return None
+            except httpx.HTTPError as e:
+                logger.warning(f"HTTP fetch of meals page failed: {e}")
+                return None
+            remaining_meals = meal_pages.extract_meal_count(page_source)
+        else:
+            wait = WebDriverWait(driver, 15)
 
-        # Set additional properties to mimic real browser
-        driver.execute_script(
-            """
-            Object.defineProperty(navigator, 'languages', {
-                get: () => ['en-US', 'en']
-            });
-            Object.defineProperty(navigator, 'plugins', {
-                get: () => [1, 2, 3, 4, 5]
-            });
-        """
-        )
+            # Add delay before navigating to meals page
+            await asyncio.sleep(0.21)
 
-        wait = WebDriverWait(driver, 15)
+            # Navigate to meals page
+            logger.info("Navigating to meals page...")
+            driver.get(MEAL_PAGE_URL)
 
-        # Navigate to STARS login page
-        print("Navigating to STARS login page...")
-        await update_status("🔐 Logging in to SRS...")
-        driver.get("https://stars.bilkent.edu.tr/srs/")
+            # Wait for page to load
+            await asyncio.sleep(0.34)
 
-        # Add some human-like delay
-        await asyncio.sleep(0.12)  # Fill in Bilkent ID and password
-        print("Entering credentials...")
-        bilkent_id_field = wait.until(
-            EC.presence_of_element_located((By.ID, "LoginForm_username"))
-        )
-        password_field = driver.find_element(By.ID, "LoginForm_password")
+            # Check if we got redirected back to login (authentication failed)
+            final_url = driver.current_url
+            if "login" in final_url.lower() or "auth" in final_url.lower():
+                logger.warning("Authentication failed - redirected back to login")
+                return None
 
-        # Human-like typing with delays
-        bilkent_id_field.clear()
-        await asyncio.sleep(0.21)
-        for char in bilkent_id:
-            bilkent_id_field.send_keys(char)
-            # await asyncio.sleep(0.17)
-
-        # await asyncio.sleep(0.31)
-        password_field.clear()
-        for char in stars_password:
-            password_field.send_keys(char)
-            # await asyncio.sleep(0.21)
-
-        # Submit login form
-        login_button = driver.find_element(By.CSS_SELECTOR, "button[type='submit']")
-        login_button.click()
-
-        # Check for login error message
-        try:
-            # Wait briefly to see if error message appears
-            await asyncio.sleep(0.23)
-            page_source = driver.page_source
-            
-            # Check for incorrect credentials message
-            srs_pass_errors = ("Password is too short (minimum is 6 characters)", "The password or Bilkent ID number entered is incorrect",)
-            if any(error in page_source for error in srs_pass_errors):
-                print("❌ Login failed: Incorrect Bilkent ID or password")
-                await update_status("❌ Login failed: Incorrect Bilkent ID or password")
-                raise LoginCredentialsError("The password or Bilkent ID number entered is incorrect.")
-                
-        except LoginCredentialsError:
-            # Re-raise the login error
-            raise
-        except Exception as e:
-            # Continue if we can't check for error (maybe page is loading)
-            pass
-
-        # Wait for OTP page to load
-        print("Waiting for OTP verification page...")
-
-        # Check if we're on the email verification page
-        try:
-            otp_field = wait.until(
-                EC.presence_of_element_located((By.ID, "EmailVerifyForm_verifyCode"))
-            )
-            print("OTP page loaded successfully")
-        except:
-            print(
-                "❌ Failed to load OTP page. Make sure to type the passwords correctly."
-            )
-            return None
+            # Wait for page content to load properly
+            wait.until(EC.presence_of_element_located((By.TAG_NAME, "body")))
 
-        # Get OTP from email
-        print("\nFetching OTP from email...")
-        await update_status("📧 Getting OTP code...")
-        otp = get_otp_from_webmail(email, email_password, wait_time=60)
-
-        if not otp:
-            print("Failed to retrieve OTP from email")
-            # Inform user without exposing technical details
-            await update_status("❌ Failed to retrieve OTP from email")
-            # Raise a specific error to let caller decide messaging
-            raise OTPRetrievalError("❌ Failed to retrieve OTP from email")
-
-        print(f"\nOTP received: {otp}")
-        await update_status(f"🔑 OTP received: {otp}")
-
-        # Enter OTP in the verification form
-        print(f"Entering OTP...")
-        otp_field.clear()
-        await asyncio.sleep(0.19)
-
-        # Human-like typing for OTP
-        for char in otp:
-            otp_field.send_keys(char)
-            await asyncio.sleep(0.23)
-
-        await asyncio.sleep(0.12)
-
-        # Submit OTP form
-        verify_button = driver.find_element(By.CSS_SELECTOR, "button[type='submit']")
-        verify_button.click()
-
-        # Wait for successful login with better error handling
-        print("Verifying OTP...")
-        try:
-            # Wait for redirect after successful OTP verification
-            wait.until(
-                lambda driver: "login" not in driver.current_url
-                or "meal" in driver.current_url
-            )
-            print("✓ OTP verification successful")
-            await update_status("✅ SRS login successful\n⏳ Fetching meal data...")
+            # Wait for meal page elements to load
+            max_wait_attempts = 3
+            remaining_meals = meal_pages.NOT_FOUND
 
-        except TimeoutException:
-            print("Timeout during OTP verification")
+            for attempt in range(max_wait_attempts):
+                try:
+                    await asyncio.sleep(0.34)
+
+                    # Try to find meal page elements
+                    try:
+                        WebDriverWait(driver, 5).until(
+                            EC.any_of(
+                                EC.presence_of_element_located((By.CLASS_NAME, "badge")),
+                                EC.presence_of_element_located(
+                                    (By.PARTIAL_LINK_TEXT, "meal")
+                                ),
+                                EC.text_to_be_present_in_element(
+                                    (By.TAG_NAME, "body"), "meal"
+                                ),
+                                EC.text_to_be_present_in_element(
+                                    (By.TAG_NAME, "body"), "remaining"
+                                ),
+                            )
+                        )
+                    except TimeoutException:
+                        pass
+
+                    # Read the count in-page rather than transferring page_source
+                    remaining_meals = meal_pages.read_meal_count(driver)
+                    if remaining_meals.found:
+                        break
+                    elif attempt < max_wait_attempts - 1:
+                        driver.refresh()
+                        wait.until(EC.presence_of_element_located((By.TAG_NAME, "body")))
+
+                except Exception as e:
+                    if attempt < max_wait_attempts - 1:
+                        driver.refresh()
+                        wait.until(EC.presence_of_element_located((By.TAG_NAME, "body")))
+
+        if remaining_meals.found:
+            logger.info(f"Meal count read via {remaining_meals.source}")
+            return remaining_meals.count
+        else:
+            logger.warning("Could not find remaining meals count on page")
             return None
 
-        # Add delay before navigating to meals page
-        await asyncio.sleep(0.21)
+    except (LoginCredentialsError, OTPRetrievalError):
+        # Callers tell the user (and drop stored credentials) based on these
+        raise
+    except TimeoutException:
+        logger.warning("Timeout waiting for page elements to load")
+        return None
+    except Exception as e:
+        logger.exception(f"Error during STARS login: {e}")
+        return None
+    finally:
+        # Close the browser
+        if driver:
+            browser.quit_driver(driver)
+        circuit_breaker.release(trials)
+
 
-        # Navigate to meals page
-        print("Navigating to meals page...")
-        driver.get("https://stars.bilkent.edu.tr/srs-v2/meal/order")
+async def get_meal_details(
+    bilkent_id, stars_password, email, email_password, status_callback=None
+):
+    """
+    Login to STARS once and read the meal balance plus orders and transactions.
 
-        # Wait for page to load
-        await asyncio.sleep(0.34)
+    The expensive login and OTP run once; the authenticated cookies are then
+    used to fetch every page in DETAIL_PAGES over HTTP in parallel.
 
-        # Check if we got redirected back to login (authentication failed)
-        final_url = driver.current_url
-        if "login" in final_url.lower() or "auth" in final_url.lower():
-            print("Authentication failed - redirected back to login")
-            return None
+    Args:
+        bilkent_id (str): Bilkent ID number
+        stars_password (str): STARS password
+        email (str): Bilkent email address for OTP
+        email_password (str): Email password
+        status_callback (callable): Optional async function to call with status updates
 
-        # Wait for page content to load properly
-        wait.until(EC.presence_of_element_located((By.TAG_NAME, "body")))
+    Returns:
+        dict: Result of meal_pages.parse_meal_details, None if failed
 
-        # Wait for meal page elements to load
-        max_wait_attempts = 3
-        page_source = None
+    Raises:
+        UpstreamUnavailableError: If STARS or webmail is known to be down
+        LoginCredentialsError: If STARS rejects the ID or password
+        OTPRetrievalError: If the OTP could not be read from webmail
+    """
 
-        for attempt in range(max_wait_attempts):
-            try:
-                await asyncio.sleep(0.34)
+    async def update_status(message: str):
+        """Helper to update status if callback is provided"""
+        if status_callback:
+            await status_callback(message)
 
-                # Try to find meal page elements
-                try:
-                    wait.until(
-                        EC.any_of(
-                            EC.presence_of_element_located((By.CLASS_NAME, "badge")),
-                            EC.presence_of_element_located(
-                                (By.PARTIAL_LINK_TEXT, "meal")
-                            ),
-                            EC.text_to_be_present_in_element(
-                                (By.TAG_NAME, "body"), "meal"
-                            ),
-                            EC.text_to_be_present_in_element(
-                                (By.TAG_NAME, "body"), "remaining"
-                            ),
-                        ),
-                        timeout=5,
-                    )
-                except:
-                    pass
-
-                page_source = driver.page_source
-
-                # Check if page has meaningful content
-                if len(page_source) > 1000 and (
-                    "meal" in page_source.lower() or "badge" in page_source.lower()
-                ):
-                    break
-                elif attempt < max_wait_attempts - 1:
-                    driver.refresh()
-                    wait.until(EC.presence_of_element_located((By.TAG_NAME, "body")))
-
-            except Exception as e:
-                if attempt < max_wait_attempts - 1:
-                    driver.refresh()
-                    wait.until(EC.presence_of_element_located((By.TAG_NAME, "body")))
-
-        if not page_source:
-            page_source = driver.page_source
-
-        # Try to find the remaining meals count with multiple patterns
-        meals_patterns = [
-            r'Remaining number of meals:\s*<span class="badge">(\d+)</span>',
-            r"remaining meals?:\s*(\d+)",
-            r"meals? remaining:\s*(\d+)",
-            r'<span class="badge">(\d+)</span>',
-            r"(\d+)\s*meals? left",
-            r"balance.*?(\d+)",
-        ]
-
-        remaining_meals = None
-        for pattern in meals_patterns:
-            meals_match = re.search(pattern, page_source, re.IGNORECASE)
-            if meals_match:
-                remaining_meals = int(meals_match.group(1))
-                break
-
-        if remaining_meals:
-            return remaining_meals
-        else:
-            print("Could not find remaining meals count on page")
+    # Shed the request before launching Chrome if an upstream is known to be down
+    trials = await circuit_breaker.admit(circuit_breaker.stars, circuit_breaker.webmail)
+
+    driver = None
+    try:
+        driver = new_stars_driver()
+
+        if not await login_to_stars(
+            driver, bilkent_id, stars_password, email, email_password, update_status
+        ):
             return None
 
+        # The browser is only needed for the login
+        cookies = driver.get_cookies()
+        browser.quit_driver(driver)
+        driver = None
+
+        logger.info(f"Fetching {len(DETAIL_PAGES)} meal pages over HTTP...")
+        results = await asyncio.gather(
+            *(diagnostics.to_thread(stars_http.fetch, url, cookies) for url in DETAIL_PAGES.values()),
+            return_exceptions=True,
+        )
+
+        pages = {}
+        for name, result in zip(DETAIL_PAGES, results):
+            if isinstance(result, stars_http.SessionExpiredError) and name == "order":
+                # The balance page is the one known to exist: the session is gone
+                logger.warning("Authentication failed - redirected back to login")
+                return None
+            if isinstance(result, Exception):
+                # One missing page still leaves the others worth showing
+                logger.warning(f"Could not fetch meal page '{name}': {result}")
+                continue
+            pages[name] = result
+
+        if not pages:
+            return None
+        return meal_pages.parse_meal_details(pages)
+
+    except (LoginCredentialsError, OTPRetrievalError):
+        # Callers tell the user (and drop stored credentials) based on these
+        raise
     except TimeoutException:
-        print("Timeout waiting for page elements to load")
+        logger.warning("Timeout waiting for page elements to load")
         return None
     except Exception as e:
-        print(f"Error during STARS login: {e}")
-        import traceback
-
-        traceback.print_exc()
+        logger.exception(f"Error during STARS login: {e}")
         return None
     finally:
         # Close the browser
         if driver:
-            driver.quit()
+            browser.quit_driver(driver)
+        circuit_breaker.release(trials)
 
 
 if __name__ == "__main__":
+    import tracing
+
+    tracing.setup_logging()
+
     # Configuration
     BILKENT_ID = "12345678"
     STARS_PASSWORD = "srspass"
@@ -350,14 +481,15 @@ if __name__ == "__main__":
     print("BILKENT STARS MEAL CHECKER")
     print("=" * 60)
 
-    remaining_meals = asyncio.run(
-        get_remaining_meals(
-            bilkent_id=BILKENT_ID,
-            stars_password=STARS_PASSWORD,
-            email=EMAIL,
-            email_password=EMAIL_PASSWORD,
+    with tracing.trace_request(secrets=(STARS_PASSWORD, EMAIL_PASSWORD)):
+        remaining_meals = asyncio.run(
+            get_remaining_meals(
+                bilkent_id=BILKENT_ID,
+                stars_password=STARS_PASSWORD,
+                email=EMAIL,
+                email_password=EMAIL_PASSWORD,
+            )
         )
-    )
 
     print("\n" + "=" * 60)
     if remaining_meals is not None:
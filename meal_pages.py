@@ -0,0 +1,241 @@
+import os
+import re
+import html
+import time
+from typing import NamedTuple, Optional
+from html.parser import HTMLParser
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+MAX_ROWS_PER_TABLE = 5  # Most recent rows shown per table in /details
+MAX_MESSAGE_LENGTH = 4096  # Telegram's limit for one message
+
+
+# Most specific first. A badge only counts when a "meal" label precedes it in
+# the same text run, so the navbar's unread-messages badge or an unlabelled
+# number (the card's TL balance, say) is never read as the meal count.
+MEAL_COUNT_PATTERNS = (
+    ("labelled_badge", re.compile(r'Remaining number of meals:\s*<span class="badge">\s*(\d+)\s*</span>', re.I)),
+    ("remaining_meals", re.compile(r"remaining meals?:\s*(\d+)", re.I)),
+    ("meals_remaining", re.compile(r"meals? remaining:\s*(\d+)", re.I)),
+    ("meals_left", re.compile(r"(\d+)\s*meals? left", re.I)),
+    ("meal_badge", re.compile(r'meals?\b[^<>]{0,40}<span class="badge">\s*(\d+)\s*</span>', re.I)),
+)
+
+# Runs in the page and returns only the labelled badge's text (or null), so
+# the browser path does not ship the whole page over WebDriver
+BADGE_SCRIPT = """
+for (const badge of document.querySelectorAll('.badge')) {
+    const label = badge.parentElement ? badge.parentElement.textContent : '';
+    if (/remaining number of meals/i.test(label)) {
+        return badge.textContent.trim();
+    }
+}
+return null;
+"""
+
+
+class MealCount(NamedTuple):
+    """
+    Meal count read from the meal page.
+
+    `count` is None when the page has no meal count; 0 is a real, empty
+    balance. `source` names what matched, for logs.
+    """
+
+    count: Optional[int]
+    source: Optional[str] = None
+
+    @property
+    def found(self) -> bool:
+        return self.count is not None
+
+
+NOT_FOUND = MealCount(None)
+
+
+def extract_meal_count(page_source: str) -> MealCount:
+    """Extract the remaining meal count from the meal page HTML."""
+    for source, pattern in MEAL_COUNT_PATTERNS:
+        match = pattern.search(page_source)
+        if match:
+            return MealCount(int(match.group(1)), source)
+    return NOT_FOUND
+
+
+def read_meal_count(driver) -> MealCount:
+    """
+    Read the labelled meal badge in the browser, falling back to the page HTML.
+
+    Returns:
+        MealCount: Found in-page ("script"), in the HTML, or NOT_FOUND
+    """
+    badge_text = driver.execute_script(BADGE_SCRIPT)
+    if badge_text and badge_text.isdigit():
+        return MealCount(int(badge_text), "script")
+    # Layout changed: fall back to the patterns over the full page once
+    return extract_meal_count(driver.page_source)
+
+
+class _TableParser(HTMLParser):
+    """Collects every <table> as a title plus rows of cell text."""
+
+    HEADING_TAGS = {"h1", "h2", "h3", "h4", "h5", "legend", "caption"}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.tables = []
+        self._heading = ""
+        self._in_heading = False
+        self._table = None
+        self._row = None
+        self._row_has_td = False
+        self._cell = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.HEADING_TAGS:
+            self._in_heading = True
+            if tag != "caption":
+                self._heading = ""
+        elif tag == "table":
+            self._table = {"title": self._heading.strip(), "header": [], "rows": []}
+        elif tag == "tr" and self._table is not None:
+            self._row = []
+            self._row_has_td = False
+        elif tag in ("td", "th") and self._row is not None:
+            self._cell = []
+            self._row_has_td = self._row_has_td or tag == "td"
+
+    def handle_endtag(self, tag):
+        if tag in self.HEADING_TAGS:
+            self._in_heading = False
+            if tag == "caption" and self._table is not None:
+                self._table["title"] = self._heading.strip()
+        elif tag in ("td", "th") and self._cell is not None:
+            self._row.append(" ".join("".join(self._cell).split()))
+            self._cell = None
+        elif tag == "tr" and self._row is not None:
+            if any(self._row):
+                # A row of only <th> cells before any data row is the header
+                if not self._table["rows"] and not self._table["header"] and not self._row_has_td:
+                    self._table["header"] = self._row
+                else:
+                    self._table["rows"].append(self._row)
+            self._row = None
+        elif tag == "table" and self._table is not None:
+            if self._table["rows"]:
+                self.tables.append(self._table)
+            self._table = None
+            self._heading = ""
+
+    def handle_data(self, data):
+        if self._cell is not None:
+            self._cell.append(data)
+        elif self._in_heading:
+            self._heading += data
+
+
+def parse_tables(page_source: str) -> list:
+    """
+    Extract the data tables of a STARS page.
+
+    Returns:
+        list: One dict per non-empty table with "title" (nearest preceding
+        heading or caption), "header" (column names) and "rows" (cell text)
+    """
+    parser = _TableParser()
+    parser.feed(page_source)
+    parser.close()
+    return parser.tables
+
+
+def parse_meal_details(pages: dict) -> dict:
+    """
+    Combine the meal pages fetched in one session into one result.
+
+    Args:
+        pages (dict): Page name -> HTML, the "order" page carries the balance
+
+    Returns:
+        dict: "remaining_meals" (int or None) and "tables" (page name -> tables)
+    """
+    remaining_meals = NOT_FOUND
+    if "order" in pages:
+        remaining_meals = extract_meal_count(pages["order"])
+    return {
+        "remaining_meals": remaining_meals.count,
+        "tables": {name: parse_tables(page) for name, page in pages.items()},
+    }
+
+
+def format_details(details: dict, max_length: int = MAX_MESSAGE_LENGTH) -> str:
+    """Render meal details as one Telegram HTML message of at most max_length characters."""
+    remaining_meals = details["remaining_meals"]
+    header = "🍽️ <b>Meals Remaining:</b> " + (
+        str(remaining_meals) if remaining_meals is not None else "unknown"
+    )
+    footer = "\n\n😊 Afiyet olsun!"
+
+    blocks = []
+    for tables in details["tables"].values():
+        for table in tables:
+            lines = ["", f"📋 <b>{html.escape(table['title'] or 'Meal records')}</b>"]
+            rows = table["rows"][:MAX_ROWS_PER_TABLE]
+            body = []
+            if table["header"]:
+                body.append(" | ".join(table["header"]))
+            body += [" | ".join(row) for row in rows]
+            lines.append("<pre>" + html.escape("\n".join(body)) + "</pre>")
+            hidden = len(table["rows"]) - len(rows)
+            if hidden > 0:
+                lines.append(f"<i>…and {hidden} more</i>")
+            blocks.append("\n".join(lines))
+
+    if not blocks:
+        return header + "\n\nNo meal history found on SRS." + footer
+
+    # Whole tables only, so no HTML tag is cut in half
+    def omitted_note(count):
+        return f"\n\n<i>…{count} more table(s) not shown</i>"
+
+    message = header
+    for shown, block in enumerate(blocks):
+        reserve = len(footer) + len(omitted_note(len(blocks)))
+        if len(message) + 1 + len(block) + reserve > max_length:
+            message += omitted_note(len(blocks) - shown)
+            break
+        message += "\n" + block
+    return message + footer
+
+
+def load_fixture(name: str) -> str:
+    with open(os.path.join(FIXTURES_DIR, name), encoding="utf-8") as f:
+        return f.read()
+
+
+def benchmark(names, runs: int = 2000) -> list:
+    """Time extract_meal_count on saved pages; microseconds per call."""
+    results = []
+    for name in names:
+        page = load_fixture(name)
+        started = time.perf_counter()
+        for _ in range(runs):
+            result = extract_meal_count(page)
+        elapsed = time.perf_counter() - started
+        results.append(
+            {
+                "fixture": name,
+                "page_bytes": len(page.encode()),
+                "result": result._asdict(),
+                "us_per_call": round(elapsed / runs * 1e6, 2),
+            }
+        )
+    return results
+
+
+if __name__ == "__main__":
+    # Benchmark the meal count extractor on the saved pages in fixtures/
+    # (their parsing is checked by tests/test_meal_pages.py)
+    fixtures = ["meal_order.html", "meal_order_zero.html", "meal_order_no_plan.html", "meal_order_no_plan_messages.html"]
+    for row in benchmark(fixtures):
+        print(row)
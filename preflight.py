@@ -0,0 +1,90 @@
+import os
+import re
+import time
+import asyncio
+import logging
+from collections import Counter
+import circuit_breaker
+from circuit_breaker import UpstreamUnavailableError
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+PREFLIGHT_PROBE = os.getenv("PREFLIGHT_PROBE", "1") == "1"  # Probe STARS/webmail before launching Chrome
+PREFLIGHT_PROBE_TTL = float(os.getenv("PREFLIGHT_PROBE_TTL", 30))  # Seconds a probe result is reused
+
+BILKENT_ID_PATTERN = re.compile(r"\d{8}")
+BILKENT_EMAIL_PATTERN = re.compile(r"[^@\s]+@(?:[a-z0-9-]+\.)*bilkent\.edu\.tr", re.IGNORECASE)
+MIN_STARS_PASSWORD_LENGTH = 6  # STARS: "Password is too short (minimum is 6 characters)"
+
+# Rejection reasons
+INVALID_BILKENT_ID = "invalid_bilkent_id"
+INVALID_EMAIL_DOMAIN = "invalid_email_domain"
+SHORT_STARS_PASSWORD = "short_stars_password"
+
+rejections = Counter()  # reason (or "<upstream>_unreachable") -> count
+_probe_cache = {}  # upstream name -> (checked_at, reachable)
+_probe_locks = {}  # upstream name -> asyncio.Lock, so one probe runs per upstream
+
+
+class CredentialsRejected(Exception):
+    """Raised when credentials fail validation before any browser work."""
+
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+
+def validate_credentials(bilkent_id: str, stars_password: str, email: str, email_password: str) -> None:
+    """
+    Reject credentials STARS or webmail would refuse anyway.
+
+    Raises:
+        CredentialsRejected: With the reason of the first failed rule
+    """
+    if not BILKENT_ID_PATTERN.fullmatch(bilkent_id):
+        reason = INVALID_BILKENT_ID
+    elif not BILKENT_EMAIL_PATTERN.fullmatch(email):
+        reason = INVALID_EMAIL_DOMAIN
+    elif len(stars_password) < MIN_STARS_PASSWORD_LENGTH:
+        reason = SHORT_STARS_PASSWORD
+    else:
+        return
+    rejections[reason] += 1
+    logger.info(f"Credentials rejected before launch: {reason}")
+    raise CredentialsRejected(reason)
+
+
+async def _reachable(breaker) -> bool:
+    """Probe an upstream's health URL, reusing the result for PREFLIGHT_PROBE_TTL."""
+    lock = _probe_locks.setdefault(breaker.name, asyncio.Lock())
+    async with lock:
+        cached = _probe_cache.get(breaker.name)
+        if cached and time.monotonic() - cached[0] < PREFLIGHT_PROBE_TTL:
+            return cached[1]
+        reachable = await asyncio.to_thread(circuit_breaker.probe, breaker.probe_url)
+        _probe_cache[breaker.name] = (time.monotonic(), reachable)
+        if not reachable:
+            logger.warning(f"Preflight probe: {breaker.name} unreachable")
+        return reachable
+
+
+async def check_upstreams() -> None:
+    """
+    Make sure STARS and webmail answer before a browser is spent on them.
+
+    Raises:
+        UpstreamUnavailableError: For the first upstream that is unreachable
+    """
+    if not PREFLIGHT_PROBE:
+        return
+    breakers = (circuit_breaker.stars, circuit_breaker.webmail)
+    results = await asyncio.gather(*(_reachable(breaker) for breaker in breakers))
+    for breaker, reachable in zip(breakers, results):
+        if not reachable:
+            rejections[f"{breaker.name}_unreachable"] += 1
+            raise UpstreamUnavailableError(breaker.name)
+
+
+def stats() -> dict:
+    return dict(rejections)
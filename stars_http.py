@@ -0,0 +1,86 @@
+import threading
+import http.cookiejar
+from urllib.parse import urljoin, urlsplit
+import httpx
+import browser
+
+MAX_REDIRECTS = 3
+REQUEST_TIMEOUT = 15  # Seconds
+
+_client = None
+_client_lock = threading.Lock()
+
+
+class SessionExpiredError(Exception):
+    """Raised when STARS redirects an authenticated fetch back to login."""
+
+    pass
+
+
+def _get_client() -> httpx.Client:
+    """
+    Process-wide HTTP client, so connections to STARS are pooled and kept alive.
+
+    Its cookie jar refuses every cookie: sessions belong to individual users
+    and are passed explicitly per request, never shared through the client.
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            no_cookies = http.cookiejar.CookieJar(
+                policy=http.cookiejar.DefaultCookiePolicy(allowed_domains=[])
+            )
+            _client = httpx.Client(
+                cookies=no_cookies,
+                follow_redirects=False,
+                timeout=REQUEST_TIMEOUT,
+                limits=httpx.Limits(max_connections=20, max_keepalive_connections=10),
+                headers={"User-Agent": browser.USER_AGENT},
+            )
+        return _client
+
+
+def cookie_header(cookies, url: str) -> str:
+    """Build a Cookie header from Selenium cookies that apply to url."""
+    parts = urlsplit(url)
+    host, path = parts.hostname or "", parts.path or "/"
+    pairs = []
+    for cookie in cookies:
+        domain = cookie.get("domain", host).lstrip(".")
+        if not (host == domain or host.endswith("." + domain)):
+            continue
+        if not path.startswith(cookie.get("path", "/")):
+            continue
+        if cookie.get("secure") and parts.scheme != "https":
+            continue
+        pairs.append(f"{cookie['name']}={cookie['value']}")
+    return "; ".join(pairs)
+
+
+def fetch(url: str, cookies) -> str:
+    """
+    GET a page with a user's browser cookies, following redirects by hand.
+
+    httpx drops an explicit Cookie header on redirects, so each hop rebuilds it.
+
+    Args:
+        url (str): Page to fetch
+        cookies (list): Cookies as returned by driver.get_cookies()
+
+    Returns:
+        str: Response body
+
+    Raises:
+        SessionExpiredError: If STARS redirects to its login page
+        httpx.HTTPError: On network errors or error status codes
+    """
+    client = _get_client()
+    for _ in range(MAX_REDIRECTS + 1):
+        response = client.get(url, headers={"Cookie": cookie_header(cookies, url)})
+        if not response.is_redirect:
+            response.raise_for_status()
+            return response.text
+        url = urljoin(url, response.headers["Location"])
+        if "login" in url.lower() or "auth" in url.lower():
+            raise SessionExpiredError(f"Redirected to {url}")
+    raise httpx.TooManyRedirects(f"More than {MAX_REDIRECTS} redirects", request=response.request)
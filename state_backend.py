@@ -0,0 +1,228 @@
+import time
+import asyncio
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+
+class StateBackend(ABC):
+    """
+    Storage for state that several bot workers must agree on: active jobs,
+    rate-limit windows and bans. All times are Unix timestamps so processes
+    on the same host (or sharing Redis) see consistent expiry.
+
+    Methods are synchronous; from the event loop go through call(), which
+    moves backends doing I/O onto a worker thread.
+    """
+
+    blocking = True  # Methods wait on disk or network
+
+    async def call(self, method: str, *args):
+        """Run one of the methods below without blocking the event loop."""
+        function = getattr(self, method)
+        if not self.blocking:
+            return function(*args)
+        return await asyncio.to_thread(function, *args)
+
+    @abstractmethod
+    def try_start_job(self, user_id: int, ttl: float) -> bool:
+        """Atomically mark a job active for user_id unless one already is. Expires after ttl seconds."""
+
+    @abstractmethod
+    def finish_job(self, user_id: int) -> bool:
+        """Clear the user's active job. Returns True if one was active."""
+
+    @abstractmethod
+    def record_message(self, user_id: int, window: float) -> int:
+        """Record a message now and return how many the user sent within the last window seconds."""
+
+    @abstractmethod
+    def ban(self, user_id: int, duration: float) -> None:
+        """Ban the user for duration seconds and reset their message history."""
+
+    @abstractmethod
+    def ban_remaining(self, user_id: int) -> int:
+        """Seconds left on the user's ban, 0 if not banned."""
+
+
+class InMemoryBackend(StateBackend):
+    """Process-local state; the original single-worker behaviour."""
+
+    blocking = False
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.active_jobs = {}  # user_id -> expiry
+        self.user_message_times = defaultdict(deque)  # user_id -> deque of timestamps
+        self.banned_users = {}  # user_id -> ban expiry
+
+    def try_start_job(self, user_id, ttl):
+        now = time.time()
+        with self._lock:
+            if self.active_jobs.get(user_id, 0) > now:
+                return False
+            self.active_jobs[user_id] = now + ttl
+            return True
+
+    def finish_job(self, user_id):
+        with self._lock:
+            return self.active_jobs.pop(user_id, None) is not None
+
+    def record_message(self, user_id, window):
+        now = time.time()
+        with self._lock:
+            message_times = self.user_message_times[user_id]
+            while message_times and message_times[0] <= now - window:
+                message_times.popleft()
+            message_times.append(now)
+            return len(message_times)
+
+    def ban(self, user_id, duration):
+        with self._lock:
+            self.banned_users[user_id] = time.time() + duration
+            self.user_message_times.pop(user_id, None)
+
+    def ban_remaining(self, user_id):
+        with self._lock:
+            ban_expiry = self.banned_users.get(user_id)
+            if ban_expiry is None:
+                return 0
+            remaining = int(ban_expiry - time.time())
+            if remaining <= 0:
+                # Ban expired, remove from banned list
+                del self.banned_users[user_id]
+                return 0
+            return remaining
+
+
+class SQLiteBackend(StateBackend):
+    """
+    State shared by worker processes on the same host through one SQLite file.
+
+    WAL mode lets readers run alongside the single writer, and every
+    check-and-set runs inside BEGIN IMMEDIATE so it holds the write lock.
+    """
+
+    def __init__(self, path: str):
+        self._path = path
+        self._local = threading.local()
+        with self._transaction() as db:
+            db.execute("CREATE TABLE IF NOT EXISTS jobs (user_id INTEGER PRIMARY KEY, expires_at REAL)")
+            db.execute("CREATE TABLE IF NOT EXISTS messages (user_id INTEGER, sent_at REAL)")
+            db.execute("CREATE INDEX IF NOT EXISTS messages_user ON messages (user_id, sent_at)")
+            db.execute("CREATE TABLE IF NOT EXISTS bans (user_id INTEGER PRIMARY KEY, expires_at REAL)")
+
+    def _connection(self):
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self._path, isolation_level=None, timeout=5)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    @contextmanager
+    def _transaction(self):
+        db = self._connection()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            yield db
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+
+    def try_start_job(self, user_id, ttl):
+        now = time.time()
+        with self._transaction() as db:
+            db.execute("DELETE FROM jobs WHERE user_id = ? AND expires_at <= ?", (user_id, now))
+            cursor = db.execute("INSERT OR IGNORE INTO jobs VALUES (?, ?)", (user_id, now + ttl))
+            return cursor.rowcount == 1
+
+    def finish_job(self, user_id):
+        with self._transaction() as db:
+            return db.execute("DELETE FROM jobs WHERE user_id = ?", (user_id,)).rowcount == 1
+
+    def record_message(self, user_id, window):
+        now = time.time()
+        with self._transaction() as db:
+            db.execute("DELETE FROM messages WHERE user_id = ? AND sent_at <= ?", (user_id, now - window))
+            db.execute("INSERT INTO messages VALUES (?, ?)", (user_id, now))
+            return db.execute("SELECT COUNT(*) FROM messages WHERE user_id = ?", (user_id,)).fetchone()[0]
+
+    def ban(self, user_id, duration):
+        with self._transaction() as db:
+            db.execute("INSERT OR REPLACE INTO bans VALUES (?, ?)", (user_id, time.time() + duration))
+            db.execute("DELETE FROM messages WHERE user_id = ?", (user_id,))
+
+    def ban_remaining(self, user_id):
+        row = self._connection().execute("SELECT expires_at FROM bans WHERE user_id = ?", (user_id,)).fetchone()
+        if row is None:
+            return 0
+        remaining = int(row[0] - time.time())
+        if remaining <= 0:
+            with self._transaction() as db:
+                db.execute("DELETE FROM bans WHERE user_id = ? AND expires_at <= ?", (user_id, time.time()))
+            return 0
+        return remaining
+
+
+class RedisBackend(StateBackend):
+    """
+    State shared across hosts through Redis, or anything speaking its protocol.
+
+    Key expiry provides the TTLs and SET NX the atomic job admission.
+    """
+
+    def __init__(self, url: str, prefix: str = "srsbot"):
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError("STATE_BACKEND=redis://... requires the 'redis' package") from e
+        self._redis = redis.Redis.from_url(url)
+        self._prefix = prefix
+
+    def _key(self, kind, user_id="*"):
+        return f"{self._prefix}:{kind}:{user_id}"
+
+    def try_start_job(self, user_id, ttl):
+        return bool(self._redis.set(self._key("job", user_id), 1, nx=True, px=int(ttl * 1000)))
+
+    def finish_job(self, user_id):
+        return self._redis.delete(self._key("job", user_id)) == 1
+
+    def record_message(self, user_id, window):
+        now = time.time()
+        key = self._key("messages", user_id)
+        pipe = self._redis.pipeline(transaction=True)
+        pipe.zremrangebyscore(key, "-inf", now - window)
+        pipe.zadd(key, {repr(now): now})
+        pipe.zcard(key)
+        pipe.expire(key, int(window) + 1)
+        return pipe.execute()[2]
+
+    def ban(self, user_id, duration):
+        pipe = self._redis.pipeline(transaction=True)
+        pipe.set(self._key("ban", user_id), 1, px=int(duration * 1000))
+        pipe.delete(self._key("messages", user_id))
+        pipe.execute()
+
+    def ban_remaining(self, user_id):
+        return max(self._redis.ttl(self._key("ban", user_id)), 0)
+
+
+def from_url(url: str) -> StateBackend:
+    """
+    Build a backend from a STATE_BACKEND value.
+
+    "memory" (default), "sqlite:///path/to/state.db", or "redis://host:port/db".
+    """
+    if not url or url == "memory":
+        return InMemoryBackend()
+    if url.startswith("sqlite:///"):
+        return SQLiteBackend(url[len("sqlite:///"):])
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisBackend(url)
+    raise ValueError(f"Unsupported STATE_BACKEND: {url}")
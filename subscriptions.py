@@ -0,0 +1,243 @@
+import os
+import json
+import asyncio
+import hashlib
+import logging
+import random
+from cryptography.fernet import Fernet, InvalidToken
+from telegram.ext import ContextTypes
+import tracing
+from get_remaining_meals import get_remaining_meals, LoginCredentialsError
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+SUBSCRIPTION_KEY = os.getenv("SUBSCRIPTION_KEY")  # Fernet key, feature is off without it
+SUBSCRIPTION_FILE = os.getenv("SUBSCRIPTION_FILE", "subscriptions.enc")
+CHECK_INTERVAL = int(os.getenv("SUBSCRIPTION_INTERVAL", 6 * 3600))  # Seconds between checks per user
+SPREAD_WINDOW = int(os.getenv("SUBSCRIPTION_SPREAD", 3600))  # First checks are spread over this window
+JITTER = int(os.getenv("SUBSCRIPTION_JITTER", 600))  # +/- seconds added to every run
+BACKGROUND_CONCURRENCY = int(os.getenv("SUBSCRIPTION_CONCURRENCY", 1))  # Background checks in flight
+BUSY_THRESHOLD = int(os.getenv("SUBSCRIPTION_BUSY_THRESHOLD", 2))  # Foreground jobs that count as busy
+BUSY_RETRY_DELAY = 300  # Seconds to wait before retrying a check deferred because the bot was busy
+
+DEFAULT_THRESHOLD = 10
+
+
+class SubscriptionStore:
+    """Subscriptions kept in memory and persisted as one Fernet-encrypted file."""
+
+    def __init__(self, key: str, filepath: str):
+        self._fernet = Fernet(key.encode())
+        self._filepath = filepath
+        self._subscriptions = {}  # user_id -> subscription dict
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self._filepath):
+            return
+        try:
+            with open(self._filepath, "rb") as f:
+                data = json.loads(self._fernet.decrypt(f.read()))
+            self._subscriptions = {int(user_id): sub for user_id, sub in data.items()}
+        except (InvalidToken, ValueError) as e:
+            # Wrong key or corrupt file: start empty rather than crash the bot
+            logger.error(f"Could not read subscriptions from {self._filepath}: {e}")
+
+    def _save(self):
+        token = self._fernet.encrypt(json.dumps(self._subscriptions).encode())
+        tmp_path = f"{self._filepath}.tmp"
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "wb") as f:
+            f.write(token)
+        os.replace(tmp_path, self._filepath)
+
+    def get(self, user_id: int):
+        return self._subscriptions.get(user_id)
+
+    def all(self):
+        return dict(self._subscriptions)
+
+    def put(self, user_id: int, subscription: dict):
+        self._subscriptions[user_id] = subscription
+        self._save()
+
+    def remove(self, user_id: int) -> bool:
+        if self._subscriptions.pop(user_id, None) is None:
+            return False
+        self._save()
+        return True
+
+
+store = None
+_background_slots = None
+_is_busy = lambda: False
+_claim_job = None
+_release_job = None
+
+
+def is_enabled() -> bool:
+    return store is not None
+
+
+def _job_name(user_id: int) -> str:
+    return f"subscription-{user_id}"
+
+
+def _initial_delay(user_id: int) -> float:
+    """Place a user's first check at a stable slot inside the spread window, plus jitter."""
+    digest = hashlib.sha256(str(user_id).encode()).digest()
+    slot = int.from_bytes(digest[:4], "big") % max(SPREAD_WINDOW, 1)
+    return max(slot + random.uniform(-JITTER, JITTER), 1)
+
+
+def _next_delay() -> float:
+    return max(CHECK_INTERVAL + random.uniform(-JITTER, JITTER), 60)
+
+
+def _schedule(job_queue, user_id: int, delay: float) -> None:
+    for job in job_queue.get_jobs_by_name(_job_name(user_id)):
+        job.schedule_removal()
+    job_queue.run_once(check_subscription, delay, data=user_id, name=_job_name(user_id))
+
+
+def setup(application, is_busy, claim_job, release_job) -> None:
+    """
+    Enable subscriptions if a key is configured and reschedule stored ones.
+
+    Args:
+        application: PTB Application (needs the job-queue extra)
+        is_busy (callable): Returns True while foreground requests use the capacity
+        claim_job (callable): Async, claims a user's job slot, False if already taken
+        release_job (callable): Async, releases a slot taken with claim_job
+    """
+    global store, _background_slots, _is_busy, _claim_job, _release_job
+
+    if not SUBSCRIPTION_KEY:
+        logger.info("SUBSCRIPTION_KEY not set, balance alerts are disabled.")
+        return
+    if application.job_queue is None:
+        logger.warning(
+            "JobQueue unavailable (install python-telegram-bot[job-queue]), balance alerts are disabled."
+        )
+        return
+
+    store = SubscriptionStore(SUBSCRIPTION_KEY, SUBSCRIPTION_FILE)
+    _background_slots = asyncio.Semaphore(BACKGROUND_CONCURRENCY)
+    _is_busy = is_busy
+    _claim_job = claim_job
+    _release_job = release_job
+
+    for user_id in store.all():
+        _schedule(application.job_queue, user_id, _initial_delay(user_id))
+    logger.info(f"Balance alerts enabled. Scheduled {len(store.all())} subscription(s).")
+
+
+def subscribe(
+    job_queue,
+    user_id: int,
+    chat_id: int,
+    threshold: int,
+    bilkent_id: str,
+    stars_password: str,
+    email: str,
+    email_password: str,
+) -> None:
+    """Store a user's (encrypted) credentials and schedule their periodic check."""
+    store.put(
+        user_id,
+        {
+            "chat_id": chat_id,
+            "threshold": threshold,
+            "bilkent_id": bilkent_id,
+            "stars_password": stars_password,
+            "email": email,
+            "email_password": email_password,
+            "last_alerted": None,
+        },
+    )
+    _schedule(job_queue, user_id, _initial_delay(user_id))
+    logger.info(f"User {user_id} subscribed to balance alerts (threshold {threshold})")
+
+
+def unsubscribe(job_queue, user_id: int) -> bool:
+    """Delete a user's stored credentials and cancel their check."""
+    for job in job_queue.get_jobs_by_name(_job_name(user_id)):
+        job.schedule_removal()
+    return store.remove(user_id)
+
+
+async def check_subscription(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Background balance check for one subscriber, deferred while the bot is busy."""
+    user_id = context.job.data
+    subscription = store.get(user_id)
+    if subscription is None:
+        return
+
+    # Only use idle capacity: foreground requests always win
+    if _is_busy() or _background_slots.locked():
+        _schedule(context.job_queue, user_id, BUSY_RETRY_DELAY + random.uniform(0, JITTER))
+        return
+
+    # Never run alongside the user's own request: both would trigger an OTP
+    # email to the same mailbox and each flow reads (and deletes) the first one
+    if not await _claim_job(user_id):
+        _schedule(context.job_queue, user_id, BUSY_RETRY_DELAY + random.uniform(0, JITTER))
+        return
+
+    secrets = (subscription["stars_password"], subscription["email"], subscription["email_password"])
+    async with _background_slots:
+        try:
+            tracing.bind_request(secrets=secrets)
+            # Selenium blocks, so run the pipeline on its own thread and event loop
+            remaining_meals = await asyncio.to_thread(
+                asyncio.run,
+                get_remaining_meals(
+                    bilkent_id=subscription["bilkent_id"],
+                    stars_password=subscription["stars_password"],
+                    email=subscription["email"],
+                    email_password=subscription["email_password"],
+                ),
+            )
+        except LoginCredentialsError:
+            if store.get(user_id) is not subscription:
+                # Unsubscribed or resubscribed with new credentials while the check ran
+                return
+            unsubscribe(context.job_queue, user_id)
+            await context.bot.send_message(
+                subscription["chat_id"],
+                "🔕 <b>Balance alerts stopped</b>\n\n"
+                "Your saved SRS credentials no longer work, so they were deleted.\n"
+                "Send /subscribe again to re-enable alerts.",
+            )
+            return
+        except Exception as e:
+            logger.warning(f"Background check failed for user {user_id}: {e}")
+            remaining_meals = None
+        finally:
+            await _release_job(user_id)
+
+    # The user may have unsubscribed, or subscribed again (a new dict with its own
+    # check), while the pipeline ran: never alert, save or reschedule for a stale entry
+    if store.get(user_id) is not subscription:
+        return
+
+    _schedule(context.job_queue, user_id, _next_delay())
+
+    if remaining_meals is None:
+        return
+
+    if remaining_meals < subscription["threshold"]:
+        if subscription["last_alerted"] != remaining_meals:
+            # Save before awaiting the send, so an /unsubscribe meanwhile is not undone
+            subscription["last_alerted"] = remaining_meals
+            store.put(user_id, subscription)
+            await context.bot.send_message(
+                subscription["chat_id"],
+                f"⚠️ <b>Low Meal Balance</b>\n\n"
+                f"🍽️ Meals remaining: {remaining_meals} (alert below {subscription['threshold']})",
+            )
+    elif subscription["last_alerted"] is not None:
+        # Balance was topped up, alert again next time it drops
+        subscription["last_alerted"] = None
+        store.put(user_id, subscription)
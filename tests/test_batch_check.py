@@ -0,0 +1,26 @@
+import io
+import time
+import asyncio
+import threading
+import batch_check
+
+
+def test_run_batch_reaches_requested_concurrency(monkeypatch):
+    in_flight = 0
+    peak = 0
+    lock = threading.Lock()
+
+    def check_account(account):
+        nonlocal in_flight, peak
+        with lock:
+            in_flight += 1
+            peak = max(peak, in_flight)
+        time.sleep(0.05)
+        with lock:
+            in_flight -= 1
+        return {"ok": True}
+
+    monkeypatch.setattr(batch_check, "check_account", check_account)
+    summary = asyncio.run(batch_check.run_batch(iter(range(64)), 64, out=io.StringIO()))
+    assert summary["accounts"] == 64
+    assert peak == 64
@@ -0,0 +1,53 @@
+import asyncio
+import pytest
+import circuit_breaker
+from circuit_breaker import CircuitBreaker, UpstreamUnavailableError, HALF_OPEN, CLOSED, OPEN
+
+
+@pytest.fixture
+def breakers(monkeypatch):
+    """STARS and webmail breakers that are both due for a half-open trial."""
+    monkeypatch.setattr(circuit_breaker, "probe", lambda url: True)
+    pair = []
+    for name in ("stars", "webmail"):
+        breaker = CircuitBreaker(name, f"https://{name}.invalid/", failure_threshold=1, reset_timeout=60)
+        breaker.record_failure()
+        breaker._opened_at -= 60
+        pair.append(breaker)
+    return pair
+
+
+def test_trial_of_an_unreached_upstream_is_released(breakers):
+    stars, webmail = breakers
+    trials = asyncio.run(circuit_breaker.admit(stars, webmail))
+    assert [breaker for breaker, _ in trials] == [stars, webmail]
+
+    # STARS answers, then the request ends at login before webmail is reached
+    stars.record_success()
+    circuit_breaker.release(trials)
+
+    assert stars.state == CLOSED
+    assert webmail.state == HALF_OPEN
+    # The next request gets the webmail trial instead of being shed
+    assert asyncio.run(circuit_breaker.admit(stars, webmail))[0][0] is webmail
+
+
+def test_release_leaves_reported_trials_alone(breakers):
+    stars, webmail = breakers
+    trials = asyncio.run(circuit_breaker.admit(stars, webmail))
+    stars.record_success()
+    webmail.record_failure()
+    circuit_breaker.release(trials)
+    assert stars.state == CLOSED
+    assert webmail.state == OPEN
+
+
+def test_release_does_not_cancel_a_later_trial(breakers):
+    stars, webmail = breakers
+    trials = asyncio.run(circuit_breaker.admit(webmail))
+    webmail.cancel_trial()
+    # Another request now owns the trial; the stale token must not free it
+    assert asyncio.run(circuit_breaker.admit(webmail))
+    circuit_breaker.release(trials)
+    with pytest.raises(UpstreamUnavailableError):
+        asyncio.run(circuit_breaker.admit(webmail))
@@ -0,0 +1,83 @@
+import pytest
+import meal_pages
+from meal_pages import MealCount, extract_meal_count, load_fixture
+
+
+@pytest.fixture
+def details():
+    return meal_pages.parse_meal_details(
+        {
+            "order": load_fixture("meal_order.html"),
+            "history": load_fixture("meal_history.html"),
+        }
+    )
+
+
+def test_labelled_badge():
+    assert extract_meal_count(load_fixture("meal_order.html")) == MealCount(37, "labelled_badge")
+
+
+def test_zero_balance_is_a_result():
+    # The navbar's unrelated badge must not win over the labelled one
+    count = extract_meal_count(load_fixture("meal_order_zero.html"))
+    assert count == MealCount(0, "labelled_badge")
+    assert count.found
+
+
+def test_card_balance_is_not_mistaken_for_meals():
+    assert not extract_meal_count(load_fixture("meal_order_no_plan.html")).found
+
+
+def test_navbar_badge_is_not_mistaken_for_meals():
+    # No meal plan, but the navbar still shows 3 unread messages in a badge
+    assert extract_meal_count(load_fixture("meal_order_no_plan_messages.html")) == meal_pages.NOT_FOUND
+
+
+def test_badge_with_a_meal_label_is_accepted():
+    page = '<div>Meals: <span class="badge">12</span></div>'
+    assert extract_meal_count(page) == MealCount(12, "meal_badge")
+
+
+def test_read_meal_count_prefers_the_in_page_badge():
+    class Driver:
+        page_source = load_fixture("meal_order.html")
+
+        def __init__(self, badge_text):
+            self.badge_text = badge_text
+
+        def execute_script(self, script):
+            return self.badge_text
+
+    assert meal_pages.read_meal_count(Driver("0")) == MealCount(0, "script")
+    assert meal_pages.read_meal_count(Driver(None)) == MealCount(37, "labelled_badge")
+
+
+def test_tables(details):
+    assert details["remaining_meals"] == 37
+    order_tables = details["tables"]["order"]
+    assert [table["title"] for table in order_tables] == ["My Orders"]
+    assert order_tables[0]["header"] == ["Date", "Meal", "Cafeteria", "Status"]
+    assert order_tables[0]["rows"][0] == ["14.10.2026", "Lunch", "Main Campus", "Served"]
+    history_tables = details["tables"]["history"]
+    assert [table["title"] for table in history_tables] == ["Transactions"]
+    assert len(history_tables[0]["rows"]) == 7
+    assert history_tables[0]["rows"][2][2] == "-1"
+
+
+def test_format_details(details):
+    message = meal_pages.format_details(details)
+    assert "<b>Meals Remaining:</b> 37" in message
+    assert "…and 2 more" in message
+    assert "&amp;" in message  # Cell text is escaped for Telegram HTML
+
+
+def test_format_details_fits_one_telegram_message():
+    row = ["x" * 300]
+    details = {
+        "remaining_meals": 3,
+        "tables": {"history": [{"title": f"T{i}", "header": [], "rows": [row] * 5} for i in range(20)]},
+    }
+    message = meal_pages.format_details(details)
+    assert len(message) <= meal_pages.MAX_MESSAGE_LENGTH
+    assert "more table(s) not shown" in message
+    assert message.endswith("Afiyet olsun!")
@@ -0,0 +1,67 @@
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+import state_backend
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def backend(request, tmp_path):
+    if request.param == "memory":
+        return state_backend.InMemoryBackend()
+    return state_backend.SQLiteBackend(str(tmp_path / "state.db"))
+
+
+def test_only_one_concurrent_claim_wins(backend):
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        results = list(pool.map(lambda _: backend.try_start_job(1, 60), range(64)))
+    assert results.count(True) == 1
+
+
+def test_claims_are_per_user(backend):
+    assert backend.try_start_job(1, 60)
+    assert backend.try_start_job(2, 60)
+    assert not backend.try_start_job(1, 60)
+
+
+def test_finish_job_frees_the_slot(backend):
+    assert backend.try_start_job(1, 60)
+    assert backend.finish_job(1)
+    assert not backend.finish_job(1)
+    assert backend.try_start_job(1, 60)
+
+
+def test_unfinished_job_expires_after_ttl(backend):
+    assert backend.try_start_job(1, 0.2)
+    assert not backend.try_start_job(1, 0.2)
+    time.sleep(0.3)
+    assert backend.try_start_job(1, 60)
+
+
+def test_message_window_expires(backend):
+    assert backend.record_message(1, 0.2) == 1
+    assert backend.record_message(1, 0.2) == 2
+    time.sleep(0.3)
+    assert backend.record_message(1, 0.2) == 1
+
+
+def test_ban_expires_and_resets_messages(backend):
+    backend.record_message(1, 60)
+    backend.ban(1, 1.5)
+    assert backend.ban_remaining(1) >= 1
+    assert backend.record_message(1, 60) == 1
+    time.sleep(1.6)
+    assert backend.ban_remaining(1) == 0
+
+
+def test_call_runs_methods_from_the_event_loop(backend):
+    async def claim_twice():
+        return [await backend.call("try_start_job", 1, 60) for _ in range(2)]
+
+    assert asyncio.run(claim_twice()) == [True, False]
+
+
+def test_from_url():
+    assert isinstance(state_backend.from_url("memory"), state_backend.InMemoryBackend)
+    with pytest.raises(ValueError):
+        state_backend.from_url("postgres://nope")
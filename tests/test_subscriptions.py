@@ -0,0 +1,87 @@
+import asyncio
+from types import SimpleNamespace
+import pytest
+from cryptography.fernet import Fernet
+import subscriptions
+
+
+class FakeJobQueue:
+    def __init__(self):
+        self.scheduled = []
+
+    def get_jobs_by_name(self, name):
+        return []
+
+    def run_once(self, callback, when, data=None, name=None):
+        self.scheduled.append(data)
+
+
+class FakeBot:
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, chat_id, text):
+        self.sent.append((chat_id, text))
+
+
+@pytest.fixture
+def context(monkeypatch, tmp_path):
+    monkeypatch.setattr(subscriptions, "store", subscriptions.SubscriptionStore(
+        Fernet.generate_key().decode(), str(tmp_path / "subscriptions.enc")
+    ))
+    monkeypatch.setattr(subscriptions, "_background_slots", asyncio.Semaphore(1))
+    monkeypatch.setattr(subscriptions, "_is_busy", lambda: False)
+
+    async def claim_job(user_id):
+        return True
+
+    async def release_job(user_id):
+        pass
+
+    monkeypatch.setattr(subscriptions, "_claim_job", claim_job)
+    monkeypatch.setattr(subscriptions, "_release_job", release_job)
+    return SimpleNamespace(job=SimpleNamespace(data=1), job_queue=FakeJobQueue(), bot=FakeBot())
+
+
+def _subscribe(job_queue, password="SRSPass123"):
+    subscriptions.subscribe(
+        job_queue, 1, 100, 10, "12345678", password, "name.surname@ug.bilkent.edu.tr", "emailPass456"
+    )
+
+
+def _pipeline_running_during(monkeypatch, action, remaining_meals=3):
+    """Stub the meal pipeline so that `action` runs while it is in progress."""
+
+    async def stub_engine(**credentials):
+        action()
+        return remaining_meals
+
+    monkeypatch.setattr(subscriptions, "get_remaining_meals", stub_engine)
+
+
+def test_low_balance_alerts_once(monkeypatch, context):
+    _subscribe(context.job_queue)
+    _pipeline_running_during(monkeypatch, lambda: None)
+    asyncio.run(subscriptions.check_subscription(context))
+    asyncio.run(subscriptions.check_subscription(context))
+    assert len(context.bot.sent) == 1
+    assert subscriptions.store.get(1)["last_alerted"] == 3
+
+
+def test_unsubscribe_during_check_is_not_undone(monkeypatch, context):
+    _subscribe(context.job_queue)
+    scheduled = len(context.job_queue.scheduled)
+    _pipeline_running_during(monkeypatch, lambda: subscriptions.unsubscribe(context.job_queue, 1))
+    asyncio.run(subscriptions.check_subscription(context))
+    assert subscriptions.store.get(1) is None
+    assert context.bot.sent == []
+    assert len(context.job_queue.scheduled) == scheduled
+
+
+def test_resubscribe_during_check_keeps_new_entry(monkeypatch, context):
+    _subscribe(context.job_queue)
+    _pipeline_running_during(monkeypatch, lambda: _subscribe(context.job_queue, password="NewPass789"))
+    asyncio.run(subscriptions.check_subscription(context))
+    assert subscriptions.store.get(1)["stars_password"] == "NewPass789"
+    assert subscriptions.store.get(1)["last_alerted"] is None
+    assert context.bot.sent == []
@@ -0,0 +1,64 @@
+import json
+import queue
+import logging
+import pytest
+import tracing
+
+
+@pytest.fixture
+def captured():
+    """A logger whose records go through RedactingQueueHandler into a queue."""
+    log_queue = queue.SimpleQueue()
+    logger = logging.getLogger("test_tracing")
+    handler = tracing.RedactingQueueHandler(log_queue)
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    yield logger, log_queue
+    logger.removeHandler(handler)
+
+
+def test_redact_masks_secrets_longest_first():
+    text = "login with hunter22 and hunter22x"
+    assert tracing.redact(text, ["hunter22", "hunter22x"]) == "login with *** and ***"
+
+
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        ("OTP received: 123456", "OTP received: ***"),
+        ("Verification Code: 12345", "Verification Code: ***"),
+        ("Remaining meals: 123456", "Remaining meals: 123456"),
+    ],
+)
+def test_redact_masks_labelled_otp_codes(text, expected):
+    assert tracing.redact(text) == expected
+
+
+def test_trace_request_ignores_short_secrets():
+    with tracing.trace_request(secrets=["abc", "longsecret"]):
+        assert tracing._secrets.get() == ("longsecret",)
+    assert tracing._secrets.get() == ()
+
+
+def test_handler_tags_and_redacts_records(captured):
+    logger, log_queue = captured
+    with tracing.trace_request(secrets=["s3cretpass"], request_id="req123"):
+        logger.info("password is %s", "s3cretpass")
+    record = log_queue.get_nowait()
+    assert record.correlation_id == "req123"
+    assert record.getMessage() == "password is ***"
+
+
+def test_handler_keeps_redacted_traceback_in_exc(captured):
+    logger, log_queue = captured
+    with tracing.trace_request(secrets=["s3cretpass"]):
+        try:
+            raise ValueError("bad password s3cretpass")
+        except ValueError:
+            logger.exception("login failed")
+    event = json.loads(tracing.JsonFormatter().format(log_queue.get_nowait()))
+    assert event["msg"] == "login failed"
+    assert "ValueError: bad password ***" in event["exc"]
+    assert "s3cretpass" not in event["exc"]
+    assert event["correlation_id"]
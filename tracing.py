@@ -0,0 +1,152 @@
+import os
+import re
+import copy
+import json
+import uuid
+import queue
+import atexit
+import logging
+import logging.handlers
+import contextvars
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+# Correlation ID of the request being processed in the current context.
+# contextvars follow asyncio tasks and asyncio.to_thread, so every log line
+# emitted while serving a request carries its ID.
+correlation_id = contextvars.ContextVar("correlation_id", default=None)
+_secrets = contextvars.ContextVar("secrets", default=())
+
+REDACTED = "***"
+MIN_SECRET_LENGTH = 4  # Shorter values would redact unrelated text
+
+# OTP codes next to a label, e.g. "OTP received: 123456" or "Verification Code: 12345"
+OTP_PATTERN = re.compile(r"((?:otp|code)\b[^\d\n]{0,20})\d{5,6}\b", re.IGNORECASE)
+
+_listener = None
+_exc_formatter = logging.Formatter()
+
+
+def new_correlation_id() -> str:
+    return uuid.uuid4().hex[:12]
+
+
+def _set_request(secrets, request_id):
+    id_token = correlation_id.set(request_id or new_correlation_id())
+    secrets_token = _secrets.set(
+        tuple(secret for secret in secrets if secret and len(secret) >= MIN_SECRET_LENGTH)
+    )
+    return id_token, secrets_token
+
+
+def bind_request(secrets=(), request_id: str = None) -> str:
+    """
+    Tag the rest of the current task with a correlation ID and secrets to redact.
+
+    Meant for the top of a per-request asyncio task, whose context is private
+    to it and discarded when it finishes. Use trace_request() everywhere else.
+
+    Returns:
+        str: The correlation ID
+    """
+    _set_request(secrets, request_id)
+    return correlation_id.get()
+
+
+@contextmanager
+def trace_request(secrets=(), request_id: str = None):
+    """
+    Tag everything logged inside the block with a correlation ID and redact secrets.
+
+    Args:
+        secrets (iterable): Values (passwords etc.) to mask in every log line
+        request_id (str): Correlation ID to use, a new one is generated if omitted
+
+    Yields:
+        str: The correlation ID
+    """
+    id_token, secrets_token = _set_request(secrets, request_id)
+    try:
+        yield correlation_id.get()
+    finally:
+        _secrets.reset(secrets_token)
+        correlation_id.reset(id_token)
+
+
+def redact(text: str, secrets=()) -> str:
+    """Mask known secrets and labelled OTP codes in a string."""
+    # Longest first so a secret containing another one is fully masked
+    for secret in sorted(secrets, key=len, reverse=True):
+        text = text.replace(secret, REDACTED)
+    return OTP_PATTERN.sub(lambda m: m.group(1) + REDACTED, text)
+
+
+class RedactingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Queue handler that redacts and tags records before they leave the caller.
+
+    prepare() runs on the logging thread, where the request's context is still
+    active; the blocking write to stderr happens later on the listener thread.
+    Tracebacks are rendered here too (exc_info cannot be pickled or outlive the
+    frame) and kept apart from the message in exc_text.
+    """
+
+    def prepare(self, record):
+        secrets = _secrets.get()
+        record = copy.copy(record)
+        record.msg = redact(record.getMessage(), secrets)
+        record.args = None
+        if record.exc_info:
+            record.exc_text = redact(_exc_formatter.formatException(record.exc_info), secrets)
+        record.exc_info = None
+        record.stack_info = None
+        record.correlation_id = correlation_id.get()
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    """Format records as one JSON object per line."""
+
+    def format(self, record):
+        event = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        request_id = getattr(record, "correlation_id", None)
+        if request_id:
+            event["correlation_id"] = request_id
+        if record.exc_info:
+            event["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            event["exc"] = record.exc_text
+        return json.dumps(event, ensure_ascii=False)
+
+
+def setup_logging(level: str = None) -> None:
+    """
+    Route all logging through a non-blocking queue to JSON lines on stderr.
+
+    Args:
+        level (str): Log level name, defaults to the LOG_LEVEL env var or INFO
+    """
+    global _listener
+
+    level = (level or os.getenv("LOG_LEVEL", "INFO")).upper()
+    if _listener is not None:
+        logging.getLogger().setLevel(level)
+        return
+
+    log_queue = queue.SimpleQueue()
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(JsonFormatter())
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(RedactingQueueHandler(log_queue))
+    root.setLevel(level)
@@ -0,0 +1,72 @@
+import os
+import logging
+from collections import deque
+from telegram.ext import BaseUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", 32))  # Updates handled at once, 1 = sequential
+
+
+def user_key(update):
+    """User whose updates must stay in order, None for updates without a user."""
+    user = getattr(update, "effective_user", None)
+    return user.id if user else None
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """
+    Processes updates from different users concurrently, each user's in order.
+
+    An update from a user whose previous update is still being handled is
+    queued behind it and run by that same task, so it does not hold one of
+    the `max_concurrent_updates` slots while waiting. Handlers therefore never
+    interleave for one user (no two credential messages racing for the same
+    job slot), while a slow Telegram round trip for one user no longer delays
+    everyone else.
+    """
+
+    def __init__(self, max_concurrent_updates: int = UPDATE_CONCURRENCY):
+        super().__init__(max_concurrent_updates)
+        self._queues = {}  # user_id -> deque of coroutines waiting their turn
+
+    @property
+    def queued_updates(self) -> int:
+        """Updates waiting behind an earlier update from the same user."""
+        return sum(len(queue) for queue in self._queues.values())
+
+    async def do_process_update(self, update, coroutine) -> None:
+        key = user_key(update)
+        if key is None:
+            await coroutine
+            return
+
+        queue = self._queues.get(key)
+        if queue is not None:
+            # The task already handling this user runs it next
+            queue.append(coroutine)
+            return
+
+        queue = self._queues[key] = deque()
+        try:
+            while True:
+                try:
+                    await coroutine
+                except Exception as e:
+                    # Application already routes handler errors to error handlers
+                    logger.warning(f"Unhandled error processing update for user {key}: {e}")
+                if not queue:
+                    break
+                coroutine = queue.popleft()
+        finally:
+            del self._queues[key]
+            # Only reached on cancellation with updates still queued
+            for pending in queue:
+                pending.close()
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
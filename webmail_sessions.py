@@ -0,0 +1,156 @@
+import os
+import hmac
+import atexit
+import time
+import hashlib
+import logging
+import secrets
+import threading
+from collections import OrderedDict
+import browser
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+WEBMAIL_SESSION_CACHE = os.getenv("WEBMAIL_SESSION_CACHE", "0") == "1"  # Opt-in
+SESSION_TTL = int(os.getenv("WEBMAIL_SESSION_TTL", 300))  # Seconds; keep below Roundcube's session lifetime
+MAX_SESSIONS = int(os.getenv("WEBMAIL_SESSION_MAX", 2))  # Each one is a live Chrome
+SWEEP_INTERVAL = 30  # Max seconds an expired session outlives its TTL while the bot is idle
+
+# Page still shows a logged-in Roundcube mailbox (no navigation, one WebDriver call)
+_VALIDITY_SCRIPT = (
+    "return !!document.getElementById('mailboxlist')"
+    " && !!window.rcmail && rcmail.task === 'mail'"
+)
+
+# Process-local secret: keys and password checks are useless outside this process
+_secret = secrets.token_bytes(32)
+
+
+def _digest(value: str) -> str:
+    return hmac.new(_secret, value.encode(), hashlib.sha256).hexdigest()
+
+
+class WebmailSessionCache:
+    """
+    Logged-in webmail Chrome sessions kept in memory between requests.
+
+    Entries are keyed by a hash of the email address, expire after `ttl`
+    seconds, and the least recently used one is closed once more than
+    `max_sessions` are held. A session is checked out (removed) while in use,
+    so it is never shared by two requests at once.
+    """
+
+    def __init__(self, ttl: float, max_sessions: int):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self._lock = threading.Lock()
+        self._sessions = OrderedDict()  # key -> (driver, password digest, expires_at)
+        self._stats = {"hits": 0, "misses": 0, "expired": 0, "invalid": 0, "evicted": 0}
+        self._sweeper = None
+
+    def _pop_expired(self, now):
+        expired = [key for key, (_, _, expires_at) in self._sessions.items() if expires_at <= now]
+        drivers = [self._sessions.pop(key)[0] for key in expired]
+        self._stats["expired"] += len(drivers)
+        return drivers
+
+    def checkout(self, email: str, email_password: str):
+        """
+        Take the cached session for this account, if there is a usable one.
+
+        Returns:
+            WebDriver or None: A driver on the logged-in mailbox page
+        """
+        key = _digest(email.strip().lower())
+        with self._lock:
+            to_close = self._pop_expired(time.monotonic())
+            entry = self._sessions.pop(key, None)
+            if entry is not None and not hmac.compare_digest(entry[1], _digest(email_password)):
+                # Same address, different password: never hand over the mailbox
+                to_close.append(entry[0])
+                entry = None
+
+        for stale in to_close:
+            browser.quit_driver(stale)
+
+        driver = entry[0] if entry else None
+        if driver is not None and not self._is_valid(driver):
+            browser.quit_driver(driver)
+            driver = None
+            with self._lock:
+                self._stats["invalid"] += 1
+
+        with self._lock:
+            self._stats["hits" if driver else "misses"] += 1
+        return driver
+
+    def checkin(self, email: str, email_password: str, driver) -> None:
+        """Park a logged-in session for reuse, evicting the least recently used ones."""
+        key = _digest(email.strip().lower())
+        now = time.monotonic()
+        with self._lock:
+            if self._sweeper is None:
+                # Expire sessions on time even if no request comes along to do it
+                self._sweeper = threading.Thread(target=self._sweep_forever, name="webmail-sweeper", daemon=True)
+                self._sweeper.start()
+            to_close = self._pop_expired(now)
+            previous = self._sessions.pop(key, None)
+            if previous is not None:
+                to_close.append(previous[0])
+            self._sessions[key] = (driver, _digest(email_password), now + self.ttl)
+            while len(self._sessions) > self.max_sessions:
+                to_close.append(self._sessions.popitem(last=False)[1][0])
+                self._stats["evicted"] += 1
+
+        for stale in to_close:
+            browser.quit_driver(stale)
+
+    def sweep(self) -> int:
+        """Close every expired session. Returns how many were closed."""
+        with self._lock:
+            expired = self._pop_expired(time.monotonic())
+        for driver in expired:
+            browser.quit_driver(driver)
+        return len(expired)
+
+    def _sweep_forever(self):
+        while True:
+            time.sleep(min(SWEEP_INTERVAL, self.ttl))
+            try:
+                if self.sweep():
+                    logger.info("Closed expired webmail sessions")
+            except Exception as e:
+                logger.warning(f"Webmail session sweep failed: {e}")
+
+    @staticmethod
+    def _is_valid(driver) -> bool:
+        try:
+            driver.switch_to.default_content()
+            return bool(driver.execute_script(_VALIDITY_SCRIPT))
+        except Exception:
+            return False
+
+    def clear(self) -> None:
+        with self._lock:
+            drivers = [driver for driver, _, _ in self._sessions.values()]
+            self._sessions.clear()
+        for driver in drivers:
+            browser.quit_driver(driver)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return {
+                "sessions": len(self._sessions),
+                **self._stats,
+                "hit_rate": round(self._stats["hits"] / lookups, 3) if lookups else None,
+            }
+
+
+cache = WebmailSessionCache(SESSION_TTL, MAX_SESSIONS)
+atexit.register(cache.clear)
+
+
+def enabled() -> bool:
+    return WEBMAIL_SESSION_CACHE